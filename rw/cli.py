@@ -19,15 +19,22 @@ from __future__ import absolute_import, division, print_function, with_statement
 
 import sys
 import os
+import time
+import signal
+import socket
 import argparse
+import functools
 import logging
 import logging.config
 
 import yaml
 import argcomplete
 import pkg_resources
+import tornado
+import tornado.gen
 import tornado.httpserver
 import tornado.ioloop
+import tornado.netutil
 import tornado.autoreload
 import tornado.util
 import jinja2
@@ -35,6 +42,9 @@ import jinja2
 import rw
 import rw.scope
 import rw.server
+import rw.process
+import rw.static
+import rw.template
 import rw.httpbase
 
 
@@ -43,6 +53,9 @@ ARG_PARSER = argparse.ArgumentParser(description=__doc__,
                                      formatter_class=argparse.RawTextHelpFormatter)
 SUB_PARSER = ARG_PARSER.add_subparsers(help='Command help')
 LOG = logging.getLogger(__name__)
+# seconds a worker keeps serving running requests after SIGTERM
+WORKER_SHUTDOWN_TIMEOUT = 5
+SHUTDOWN_POLL_INTERVAL = 0.05
 
 
 def command(func):
@@ -55,7 +68,10 @@ def command(func):
 @command
 def serv(args):
     """Serve a rueckenwind application"""
-    if not args.no_debug:
+    workers = rw.process.parse_workers(args.workers)
+    if workers > 1 and not args.no_debug:
+        LOG.warning('autoreload is not available with multiple workers')
+    elif not args.no_debug:
         tornado.autoreload.start()
 
     extra = []
@@ -68,18 +84,111 @@ def serv(args):
         extra.append(os.path.abspath(args.cfg))
 
     listen = (int(args.port), args.address)
+    if workers > 1:
+        serv_workers(args.MODULE, extra, listen, workers, args.loop,
+                     debug=not args.no_debug)
+        return
+
+    install_ioloop(args.loop)
     ioloop = tornado.ioloop.IOLoop.instance()
     setup_app(app=args.MODULE, extra_configs=extra,
-              ioloop=ioloop, listen=listen)
+              ioloop=ioloop, listen=listen, debug=not args.no_debug)
     ioloop.start()
 
 
-def setup_app(app, extra_configs=None, ioloop=None, listen=None):
-    if ioloop is None:
-        ioloop = tornado.ioloop.IOLoop.current()
-    if extra_configs is None:
-        extra_configs = []
+@command
+def static(args):
+    """Build static files for deployment"""
+    extra = [os.path.abspath(args.cfg)] if args.cfg else []
+    app = load_app(args.MODULE, extra)
+    settings = app.scope['settings']
+    path = args.out or settings.get('rw.static.options', {}).get('build')
+    if not path:
+        static.parser.error('no output directory, use --out or '
+                            'configure rw.static.options: build')
+    path = path.format(**os.environ)
+
+    static_files = rw.static.Static()
+    static_files.handlers.extend(
+        (base_uri, rw.static.StaticHandler, roots)
+        for base_uri, roots in rw.static.get_sources(settings.get('rw.static', {})))
+    static_files.setup()
+    static_files.build_manifest()
+    rw.static.build(static_files, path)
+    LOG.info('wrote %d static files to %s', len(static_files.manifest), path)
+
+
+@command
+def templates(args):
+    """Compile templates into the bytecode cache"""
+    extra = [os.path.abspath(args.cfg)] if args.cfg else []
+    app = load_app(args.MODULE, extra)
+    template_env = app.scope['template_env']
+    if template_env.bytecode_cache is None:
+        templates.parser.error('no bytecode cache, configure rw.templates: bytecode_cache')
+    names = rw.template.compile_templates(template_env)
+    LOG.info('compiled %d templates', len(names))
+
+
+def serv_workers(app, extra_configs, listen, workers, loop='tornado', debug=True):
+    """Serve `app` from `workers` processes sharing the listening sockets.
+
+    The app gets loaded and configured in this process, the other
+    startup phases run inside of every worker after forking.
+    """
+    app = load_app(app, extra_configs, debug)
+    port, address = listen
+    sockets = tornado.netutil.bind_sockets(port, address,
+                                           reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+
+    # the configuration phase runs on an IOLoop of its own, the
+    # workers must not inherit an initialized IOLoop
+    scope = rw.scope.Scope()
+    config_loop = tornado.ioloop.IOLoop(make_current=False)
+    with scope():
+        config_loop.run_sync(rw.server.configure)
+    config_loop.close()
+
+    worker_id = rw.process.fork_workers(workers)
+    LOG.info('worker %d started', worker_id)
+    install_ioloop(loop)
+    ioloop = tornado.ioloop.IOLoop.instance()
+    http_server_settings = app.scope['settings'].get('httpserver', {})
+    server = tornado.httpserver.HTTPServer(app, **http_server_settings)
+    server.add_sockets(sockets)
+
+    def stop(signum, frame):
+        ioloop.add_callback_from_signal(shutdown)
+
+    @tornado.gen.coroutine
+    def shutdown():
+        yield stop_server(server, app)
+        ioloop.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    with scope():
+        ioloop.run_sync(functools.partial(rw.server.start, configured=True))
+    ioloop.start()
+
+
+@tornado.gen.coroutine
+def stop_server(server, app, timeout=WORKER_SHUTDOWN_TIMEOUT):
+    """Stop accepting connections and wait for running requests of `app`
+
+    Waits at most `timeout` seconds.
+    """
+    server.stop()
+    deadline = time.time() + timeout
+    while app.active_requests and time.time() < deadline:
+        yield tornado.gen.sleep(SHUTDOWN_POLL_INTERVAL)
+
 
+def load_app(app, extra_configs=None, debug=True):
+    """Return `app`, loading it first if it is given as module path
+
+    With `debug` set to false the app runs in production mode,
+    regardless of ``rw.http: debug`` in its configuration.
+    """
     if isinstance(app, tornado.util.basestring_type):
         module_path = app
         module_name = 'root'
@@ -89,7 +198,39 @@ def setup_app(app, extra_configs=None, ioloop=None, listen=None):
         module = __import__(module_path, fromlist=[module_name])
         module = getattr(module, module_name)
         app = rw.httpbase.Application(root=module, extra_configs=extra_configs)
+    if not debug:
+        app.scope['settings'].setdefault('rw.http', {})['debug'] = False
+    return app
+
 
+def install_ioloop(loop):
+    """Run tornado on top of the asyncio event loop
+
+    :param str loop: ``tornado`` to keep tornado's default IOLoop,
+                     ``asyncio`` or ``uvloop`` for the asyncio event loop
+                     (with the uvloop implementation if ``uvloop``)
+    """
+    if loop == 'tornado':
+        return
+
+    import asyncio
+    if loop == 'uvloop':
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    if tornado.version_info < (5, 0):
+        # since tornado 5 the IOLoop runs on asyncio by default
+        from tornado.platform.asyncio import AsyncIOMainLoop
+        AsyncIOMainLoop().install()
+
+
+def setup_app(app, extra_configs=None, ioloop=None, listen=None, debug=True):
+    if ioloop is None:
+        ioloop = tornado.ioloop.IOLoop.current()
+    if extra_configs is None:
+        extra_configs = []
+
+    app = load_app(app, extra_configs, debug)
     http_server_settings = app.scope['settings'].get('httpserver', {})
     server = tornado.httpserver.HTTPServer(app, **http_server_settings)
     if listen:
@@ -148,9 +289,31 @@ serv.parser.add_argument('--no-debug', action='store_true',
                          help='Run in production mode')
 serv.parser.add_argument('-c', '--cfg', type=str,
                          help='Additional config to load')
+serv.parser.add_argument('-w', '--workers', type=str, default='1',
+                         help='Number of worker processes, "auto" for one per CPU')
+serv.parser.add_argument('--loop', choices=['tornado', 'asyncio', 'uvloop'],
+                         default='tornado',
+                         help='Event loop to run on (uvloop must be installed)')
 serv.parser.add_argument('MODULE',
                          help='Module to serve')
 
+static.parser.add_argument('ACTION', choices=['build'],
+                           help='build: write hashed and gzipped copies of '
+                                'all static files and a manifest')
+static.parser.add_argument('-o', '--out', type=str,
+                           help='Output directory, defaults to rw.static.options: build')
+static.parser.add_argument('-c', '--cfg', type=str,
+                           help='Additional config to load')
+static.parser.add_argument('MODULE',
+                           help='Module to build static files of')
+
+templates.parser.add_argument('ACTION', choices=['compile'],
+                              help='compile: store all templates in the bytecode cache')
+templates.parser.add_argument('-c', '--cfg', type=str,
+                              help='Additional config to load')
+templates.parser.add_argument('MODULE',
+                              help='Module to compile templates of')
+
 
 def main():
     """Entry point of rw cli"""
@@ -0,0 +1,132 @@
+# Copyright 2015 Florian Ludwig
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""gzip compression of responses
+
+Enabled by configuration, all values are optional::
+
+    rw.http:
+      gzip:
+        level: 6  # zlib compression level
+        min_size: 1024  # smaller responses are sent uncompressed
+        thread_size: 65536  # larger responses are compressed in a thread
+
+Static files are served from their gzipped copy of ``rw static build``
+if available, otherwise compressed once and kept in memory.
+"""
+from __future__ import absolute_import, division, print_function, with_statement
+
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+import tornado.web
+import tornado.process
+
+
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_THREAD_SIZE = 64 * 1024
+
+
+def gzip_bytes(data, level=DEFAULT_LEVEL):
+    """return `data` in gzip format"""
+    # wbits offset by 16 makes zlib write gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def accepts_gzip(request):
+    """check if the client of `request` accepts gzip encoded responses
+
+    Codings with ``q=0`` are refused, an explicit ``gzip`` entry takes
+    precedence over ``*``."""
+    header = request.headers.get('Accept-Encoding', '').lower()
+    if 'gzip' not in header and '*' not in header:
+        return False
+    wildcard = False
+    for coding in header.split(','):
+        params = coding.split(';')
+        name = params[0].strip()
+        if name not in ('gzip', 'x-gzip', '*'):
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == '*':
+            wildcard = quality > 0
+        else:
+            return quality > 0
+    return wildcard
+
+
+def is_compressible(content_type):
+    """check if content of `content_type` is worth compressing"""
+    if not content_type:
+        return False
+    content_type = content_type.split(';', 1)[0].strip()
+    if content_type.startswith('text/'):
+        return True
+    return content_type in tornado.web.GZipContentEncoding.CONTENT_TYPES
+
+
+def add_vary(headers):
+    """mark response `headers` as varying with the ``Accept-Encoding``"""
+    if 'Vary' in headers:
+        if 'accept-encoding' not in headers['Vary'].lower():
+            headers['Vary'] += ', Accept-Encoding'
+    else:
+        headers['Vary'] = 'Accept-Encoding'
+
+
+class Compression(object):
+    """Settings for compressing responses
+
+    :param int level: zlib compression level
+    :param int min_size: bodies smaller than this are not compressed
+    :param int thread_size: bodies of this size or larger are compressed
+                            on a thread pool to not block the IOLoop
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, min_size=DEFAULT_MIN_SIZE,
+                 thread_size=DEFAULT_THREAD_SIZE):
+        self.level = level
+        self.min_size = min_size
+        self.thread_size = thread_size
+        self._executor = None
+
+    def compress(self, data):
+        """compress `data` on the current thread"""
+        return gzip_bytes(data, self.level)
+
+    def compress_async(self, data):
+        """compress `data` on a thread pool, returns a future"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(tornado.process.cpu_count())
+        return self._executor.submit(gzip_bytes, data, self.level)
+
+
+def from_config(cfg):
+    """return `Compression` for the ``rw.http: gzip`` setting
+
+    None if compression is disabled."""
+    if not cfg:
+        return None
+    if cfg is True:
+        cfg = {}
+    return Compression(**cfg)
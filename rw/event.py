@@ -22,6 +22,8 @@ from __future__ import absolute_import, division, print_function, with_statement
 
 from tornado import gen
 
+import rw.gen
+
 
 class Event(set):
     """
@@ -36,16 +38,16 @@ class Event(set):
         self.name = name
         self.accumulator = accumulator
 
-    @gen.coroutine
+    @rw.gen.coroutine
     def __call__(self, *args, **kwargs):
         re = []
         futures = []
         for func in self:
             result = func(*args, **kwargs)
-            if isinstance(result, gen.Future):
+            if rw.gen.is_awaitable(result):
                 # we are not waiting for future objects result here
                 # so they evaluate in parallel
-                futures.append((func, result))
+                futures.append((func, rw.gen.maybe_future(result)))
             else:
                 re.append(result)
 
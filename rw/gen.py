@@ -1,5 +1,74 @@
+import sys
+import types
+import functools
+
+try:
+    import contextvars
+except ImportError:  # python < 3.7
+    contextvars = None
+
 import tornado.gen
 from tornado.gen import *
+from tornado.concurrent import is_future
+
+try:
+    from inspect import isawaitable, iscoroutinefunction
+except ImportError:  # python < 3.5
+    def isawaitable(obj):
+        return False
+
+    def iscoroutinefunction(func):
+        return False
+
+
+# Run every step of a coroutine inside the context it got created in,
+# tornado resumes coroutines from plain IOLoop callbacks.  Set by
+# `rw.scope.use_contextvars`, coroutines defined before are not affected.
+COPY_CONTEXT = False
+
+
+def _context_generator(context, generator):
+    """drive `generator` (or native coroutine) inside `context`"""
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                yielded = context.run(generator.send, value)
+            else:
+                yielded = context.run(generator.throw, *error)
+        except StopIteration as e:
+            raise tornado.gen.Return(getattr(e, 'value', None))
+        error = None
+        try:
+            value = yield yielded
+        except Exception:
+            value = None
+            error = sys.exc_info()
+
+
+# runs a generator as tornado coroutine
+_run_generator = tornado.gen.coroutine(lambda generator: generator)
+
+
+def _in_context(func):
+    """wrap generator function `func` to run inside a copy of the
+    context it gets called in
+
+    Without `COPY_CONTEXT` at decoration time `func` is returned
+    unchanged, so there is no overhead without contextvars.
+    """
+    if not COPY_CONTEXT:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        context = contextvars.copy_context()
+        result = context.run(func, *args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            return _context_generator(context, result)
+        return result
+    return wrapper
 
 
 def coroutine(func, replace_callback=True):
@@ -25,7 +94,32 @@ def coroutine(func, replace_callback=True):
 
     From the caller's perspective, ``@gen.coroutine`` is similar to
     the combination of ``@return_future`` and ``@gen.engine``.
+
+    Native coroutines (``async def``) are supported as well, they get
+    started when called and their result is returned as `.Future`.
     """
-    re = tornado.gen._make_coroutine_wrapper(func, replace_callback=True)
+    if iscoroutinefunction(func):
+        @functools.wraps(func)
+        def re(*args, **kwargs):
+            return maybe_future(func(*args, **kwargs))
+    else:
+        re = tornado.gen._make_coroutine_wrapper(_in_context(func), replace_callback=True)
     re._rw_wrapped_function = func
     return re
+
+
+def is_awaitable(obj):
+    """True if `obj` is a `.Future` or can be awaited (e.g. a native coroutine)"""
+    return is_future(obj) or isawaitable(obj)
+
+
+def maybe_future(obj):
+    """Convert awaitables to `.Future` and return anything else untouched"""
+    if is_future(obj):
+        return obj
+    if isawaitable(obj):
+        if COPY_CONTEXT and hasattr(obj, 'send'):
+            context = contextvars.copy_context()
+            return _run_generator(_context_generator(context, obj))
+        return tornado.gen.convert_yielded(obj)
+    return obj
@@ -1,13 +1,25 @@
+import time
 import inspect
+
 import tornado.web
 
 from . import scope
 
+import rw.gen
 import rw.plugin
 import rw.routing
 import rw.template
 
 
+STREAM_CHUNK_SIZE = 16 * 1024
+
+try:
+    StopAsyncIteration
+except NameError:
+    # python 2, there are no async templates
+    StopAsyncIteration = StopIteration
+
+
 class Module(rw.plugin.Plugin):
     def __init__(self, name, resources=None):
         super(Module, self).__init__(name)
@@ -47,16 +59,94 @@ class Module(rw.plugin.Plugin):
                 current_scope.setdefault('rw.http', {})['routing_table'] = routes
         return routes
 
-    @scope.inject
-    def render_template(self, template_name, template_env, handler):
+    def get_template(self, template_name, template_env):
+        """Load template, names not starting with "/" are relative to
+        the resources of this module"""
         if not template_name.startswith('/'):
             template_name = self.resources + '/' + template_name
-        template = template_env.get_template(template_name)
-        handler.finish(template.render(**handler))
+        return template_env.get_template(template_name)
+
+    @scope.inject
+    def render_template(self, template_name, template_env, handler):
+        """Render template and finish the request with the result
+
+        Async templates are rendered in the background, the request
+        is handled once rendering is done.  Errors are handled like
+        errors of the route itself.
+        """
+        template = self.get_template(template_name, template_env)
+        if template_env.is_async:
+            future = self._render_async(template, handler)
+            wait_for = getattr(handler, 'wait_for', None)
+            if wait_for is not None:
+                wait_for(future)
+            return future
+        timing = getattr(handler, 'timing', None)
+        if timing is None:
+            handler.finish(template.render(**handler))
+            return
+        start = time.time()
+        content = template.render(**handler)
+        timing.template += time.time() - start
+        handler.finish(content)
+
+    @rw.gen.coroutine
+    def _render_async(self, template, handler):
+        context = yield rw.template.resolve_awaitables(handler)
+        # awaiting the handler's values is not part of rendering
+        start = time.time()
+        content = yield template.render_async(**context)
+        timing = getattr(handler, 'timing', None)
+        if timing is not None:
+            timing.template += time.time() - start
+        handler.finish(content)
 
-    def _generate_decorator(self, method, path):
+    @scope.inject
+    @rw.gen.coroutine
+    def stream_template(self, template_name, template_env, handler, settings,
+                        chunk_size=None):
+        """Like `render_template` but send the output while rendering
+
+        The output is flushed to the client every `chunk_size` characters,
+        by default configured by ``rw.templates: stream_chunk_size``.
+        Only the time spent rendering, not flushing, counts as template
+        time of the ``Server-Timing`` header, which is sent with the first
+        flush already.
+        """
+        template = self.get_template(template_name, template_env)
+        if chunk_size is None:
+            chunk_size = settings.get('rw.templates', {}).get('stream_chunk_size',
+                                                              STREAM_CHUNK_SIZE)
+        timing = getattr(handler, 'timing', None)
+        if template_env.is_async:
+            context = yield rw.template.resolve_awaitables(handler)
+            parts = template.generate_async(**context)
+        else:
+            parts = template.generate(**handler)
+        buffered = 0
+        while True:
+            start = time.time()
+            try:
+                if template_env.is_async:
+                    part = yield parts.__anext__()
+                else:
+                    part = next(parts)
+            except (StopIteration, StopAsyncIteration):
+                break
+            finally:
+                if timing is not None:
+                    timing.template += time.time() - start
+            handler.write(part)
+            buffered += len(part)
+            if buffered >= chunk_size:
+                buffered = 0
+                yield handler.flush()
+        handler.finish()
+
+    def _generate_decorator(self, method, path, stream=False):
         def decorator(fn):
             fn = scope.inject(fn)
+            fn.rw_stream = stream
             fn.rw_route = self.routes.append((method, path, self, fn))
             return fn
 
@@ -74,7 +164,7 @@ class Module(rw.plugin.Plugin):
 
         return self._generate_decorator('get', path)
 
-    def post(self, path):
+    def post(self, path, stream=False):
         """Expose a function for HTTP POST requests
 
         Example usage::
@@ -82,10 +172,14 @@ class Module(rw.plugin.Plugin):
             @post('/save')
             def save(self):
                 ...
+
+        With `stream` the function is called before the body arrived,
+        it reads the body from the injected
+        `rw.httpbase.BodyStream` ``body_stream``.
         """
-        return self._generate_decorator('post', path)
+        return self._generate_decorator('post', path, stream)
 
-    def put(self, path):
+    def put(self, path, stream=False):
         """Expose a function for HTTP PUT requests
 
         Example usage::
@@ -93,8 +187,10 @@ class Module(rw.plugin.Plugin):
             @put('/elements/<name>')
             def save(self, name):
                 ...
+
+        For `stream` see `post`.
         """
-        return self._generate_decorator('put', path)
+        return self._generate_decorator('put', path, stream)
 
     def delete(self, path):
         """Expose a function for HTTP DELETE requests
@@ -14,29 +14,40 @@
 from __future__ import absolute_import, division, print_function, with_statement
 
 import os
-import inspect
+import json
+import time
+import logging
 
 import tornado.web
 import tornado.httpserver
 import tornado.httputil
 import tornado.ioloop
+import tornado.queues
 from tornado import gen
 from tornado import iostream
 from tornado.web import HTTPError
-from tornado.concurrent import is_future
+from tornado.concurrent import Future, is_future
 from tornado.web import _has_stream_request_body
 import tornado.routing
 
 import rw.cfg
+import rw.gen
 import rw.scope
 import rw.routing
 import rw.template
 import rw.server
 import rw.event
+import rw.metrics
+import rw.compress
+import rw.multipart
 
 
+LOG = logging.getLogger(__name__)
 PRE_REQUEST = rw.event.Event('httpbase.pre_request')
 POST_REQUEST = rw.event.Event('httpbase.post_request')
+BODY_STREAM_CHUNKS = 16
+_BODY_END = object()
+_NOT_PARSED = object()
 
 
 class Application(tornado.routing.ReversibleRouter):
@@ -52,6 +63,10 @@ class Application(tornado.routing.ReversibleRouter):
         self.settings = {}
         self.rw_settings = {}
         self.root = root
+        self.server_timing = False
+        self.compression = None
+        self.multipart = None
+        self.active_requests = 0  # requests received but not handled yet
         self.scope = rw.scope.Scope()
         self.scope['app'] = self
         self.extra_configs = extra_configs
@@ -60,12 +75,19 @@ class Application(tornado.routing.ReversibleRouter):
             self.scope['settings'] = rw.cfg.read_configs(self.root.name,
                                                          self.extra_configs)
 
-            pkgs = self.scope['settings'].get('rw.templates', {}).get('pkgs', None)
+            cfg_templates = self.scope['settings'].get('rw.templates', {})
+            pkgs = cfg_templates.get('pkgs', None)
             if not pkgs:
                 pkgs = [root.name]
 
-            self.scope['template_env'] = rw.template.create_template_env(pkgs)
+            bytecode_cache = rw.template.create_bytecode_cache(
+                cfg_templates.get('bytecode_cache'))
+            self.scope['template_env'] = rw.template.create_template_env(
+                pkgs, bytecode_cache, cfg_templates.get('enable_async', False))
             self.scope['template_env'].globals['app'] = self
+            rw.server.PHASE_CONFIGURATION.add(self.configure)
+            rw.server.PHASE_SETUP.add(self.setup)
+            rw.server.PHASE_POST_START.add(self.post_start)
         else:
             self.handler = handler
             self.scope['settings'] = {}
@@ -75,22 +97,38 @@ class Application(tornado.routing.ReversibleRouter):
         # compatibility so we can mount tornado RequestHandlers
         self.ui_modules = {}
         self.ui_methods = {}
-        rw.server.PHASE_CONFIGURATION.add(self.configure)
 
     def configure(self):
         with self.scope():
             return self._scoped_configure()
 
-    @gen.coroutine
+    @rw.gen.coroutine
     def _scoped_configure(self):
         yield rw.scope.setup_app_scope(self.root.name, self.scope)
         self.rw_settings = self.scope['settings']
         cfg_rw_http = self.rw_settings.setdefault('rw.http', {})
         cfg_rw_http['live_settings'] = self.settings
         self._configure_cookie_secret()
+        self.compression = rw.compress.from_config(cfg_rw_http.get('gzip'))
+        self.multipart = rw.multipart.from_config(cfg_rw_http.get('multipart'))
 
         yield self.scope.activate(self.root)
 
+    def setup(self):
+        if not self.debug:
+            rw.template.preload(self.scope['template_env'])
+
+    @property
+    def debug(self):
+        """Running in development mode, configured by ``rw.http: debug``"""
+        return self.scope['settings'].get('rw.http', {}).get('debug', True)
+
+    def post_start(self):
+        if self.rw_settings.get('rw.scope', {}).get('freeze', False):
+            # app level values are not supposed to change after startup,
+            # index them so lookups during requests are a single dict hit
+            self.scope.freeze()
+
     def _configure_cookie_secret(self):
         cfg = self.rw_settings['rw.http']
         if 'cookie_secret' in cfg:
@@ -113,13 +151,19 @@ class Application(tornado.routing.ReversibleRouter):
         """Called by `tornado.httpserver.HTTPServer` to handle a request."""
         return RequestDispatcher(self, request_conn)
 
-    @gen.coroutine
-    def _handle_request(self, request_scope, request):
+    @rw.gen.coroutine
+    def _handle_request(self, request_scope, request, found=None, error=None):
         handler = self.handler(self, request)
+        if found is not None:
+            handler.found = found
         request_scope['handler'] = handler
         try:
             yield PRE_REQUEST()
+            if error is not None:
+                raise error
             yield handler._execute([])
+            while handler._waiting:
+                yield handler._waiting.pop(0)
             yield POST_REQUEST()
         except Exception as e:
             # Ensure exceptions in PRE and POST_REQUEST are
@@ -134,9 +178,141 @@ class Application(tornado.routing.ReversibleRouter):
         # request handling
         request_future.result()
 
-    def log_request(self, request):
-        # TODO print(request)
-        pass
+    def log_request(self, handler):
+        """Called by the handler after finishing a request.
+
+        Like in tornado the ``log_function`` setting can be used
+        to customize logging."""
+        log_function = self.settings.get('log_function')
+        if log_function is not None:
+            log_function(handler)
+
+
+class HTTPServerRequest(tornado.httputil.HTTPServerRequest):
+    """Request that parses its body on first access of `arguments`,
+    `body_arguments` or `files`
+
+    Routes that only look at the raw `body` never pay for parsing it.
+    """
+    _body_pending = False
+
+    def _parse_body(self):
+        self._body_pending = True
+
+    def _ensure_body_parsed(self):
+        if self._body_pending:
+            self._body_pending = False
+            super(HTTPServerRequest, self)._parse_body()
+
+    @property
+    def arguments(self):
+        self._ensure_body_parsed()
+        return self._arguments
+
+    @arguments.setter
+    def arguments(self, value):
+        self._arguments = value
+
+    @property
+    def body_arguments(self):
+        self._ensure_body_parsed()
+        return self._body_arguments
+
+    @body_arguments.setter
+    def body_arguments(self, value):
+        self._body_arguments = value
+
+    @property
+    def files(self):
+        self._ensure_body_parsed()
+        return self._files
+
+    @files.setter
+    def files(self, value):
+        self._files = value
+
+
+class BodyStream(object):
+    """Body of a request to a streaming route, read chunk by chunk
+
+    Routes declared with ``stream=True`` are called as soon as the
+    headers arrived and get the body stream injected as `body_stream`::
+
+        @mod.post('/upload', stream=True)
+        @rw.gen.coroutine
+        def upload(handler, body_stream):
+            while True:
+                chunk = yield body_stream.read()
+                if chunk is None:
+                    break
+                ...
+
+    At most `max_chunks` chunks are buffered, reading from the connection
+    pauses until the route consumed some of them.  Chunks arriving after
+    the request got handled are dropped.
+    """
+
+    def __init__(self, max_chunks=BODY_STREAM_CHUNKS):
+        self.max_chunks = max_chunks
+        self._queue = tornado.queues.Queue()
+        self._room = None  # resolved once the route consumed a chunk
+        self._done = False
+        self.finished = False
+        self.closed = False
+        self.discarding = False
+
+    def put(self, chunk):
+        """add `chunk`, returns a future resolving once there is room
+        or None if there is room left"""
+        if self.discarding:
+            return None
+        self._queue.put_nowait(chunk)
+        if self._queue.qsize() <= self.max_chunks:
+            return None
+        if self._room is None:
+            self._room = Future()
+        return self._room
+
+    def finish(self):
+        """mark the end of the body"""
+        self.finished = True
+        self._queue.put_nowait(_BODY_END)
+
+    def close(self):
+        """the connection closed before the body was complete"""
+        if not self.finished:
+            self.closed = True
+            self._queue.put_nowait(_BODY_END)
+        self._make_room()
+
+    def discard(self):
+        """drop buffered and further chunks, nobody is reading them"""
+        self.discarding = True
+        while self._queue.qsize():
+            self._queue.get_nowait()
+        self._make_room()
+
+    def _make_room(self):
+        if self._room is not None:
+            room, self._room = self._room, None
+            room.set_result(None)
+
+    @rw.gen.coroutine
+    def read(self):
+        """return the next chunk of the body, None after the last one
+
+        Raises `tornado.iostream.StreamClosedError` if the client
+        disconnected before sending the complete body."""
+        if not self._done:
+            chunk = yield self._queue.get()
+            if self._queue.qsize() <= self.max_chunks:
+                self._make_room()
+            if chunk is not _BODY_END:
+                raise gen.Return(chunk)
+            self._done = True
+        if self.closed:
+            raise iostream.StreamClosedError()
+        raise gen.Return(None)
 
 
 class RequestDispatcher(tornado.httputil.HTTPMessageDelegate):
@@ -145,49 +321,132 @@ class RequestDispatcher(tornado.httputil.HTTPMessageDelegate):
         self.connection = connection
         self.request = None
         self.chunks = []
-        self.handler_class = None
-        self.handler_kwargs = None
-        self.path_args = []
-        self.path_kwargs = {}
+        self.found = None
+        self.body_stream = None
+        self.multipart = None
+        self.error = None
         self.stream_request_body = False
+        self.active = False
+        self.executed = False
 
     def headers_received(self, start_line, headers):
-        self.request = tornado.httputil.HTTPServerRequest(
+        self.request = HTTPServerRequest(
             connection=self.connection, start_line=start_line,
             headers=headers)
 
+        app = self.application
+        app.active_requests += 1
+        self.active = True
+        if app.root is not None:
+            try:
+                self._find_stream_route()
+            except Exception:
+                # leave it to the request handling to fail properly
+                LOG.exception('Failed to route %s %s', self.request.method,
+                              self.request.path)
+                self.found = None
+
         if self.stream_request_body:
-            self.request.body = Future()
-            return self.execute()
+            cfg = app.scope['settings'].get('rw.http', {})
+            if 'max_stream_body_size' in cfg:
+                self.connection.set_max_body_size(cfg['max_stream_body_size'])
+            self.request.body = b''
+            self.body_stream = BodyStream()
+            self.execute()
+        elif app.multipart is not None:
+            self.multipart = app.multipart.parser(headers)
+
+    def _find_stream_route(self):
+        """route before the body arrives if it might go to a route with
+        ``stream=True``
+
+        Other requests are routed when handled, after `PRE_REQUEST`,
+        so subscribers are still able to rewrite the path."""
+        with self.application.scope():
+            routing_table = rw.scope.get('rw.http')['routing_table']
+        if self.request.method.lower() not in routing_table.stream_methods:
+            return
+        found = routing_table.find_call(self.request.method, self.request.path)
+        plan = found[2]
+        if plan is not None and plan.stream:
+            self.found = found
+            self.stream_request_body = True
 
     def data_received(self, data):
         if self.stream_request_body:
-            return self.handler.data_received(data)
+            return self.body_stream.put(data)
+        elif self.multipart is not None:
+            self._parse_multipart(data)
         else:
             self.chunks.append(data)
 
     def finish(self):
         if self.stream_request_body:
-            self.request.body.set_result(None)
+            self.body_stream.finish()
+        elif self.multipart is not None:
+            self.request.body = b''
+            form = self._parse_multipart()
+            if form is not None:
+                for name, values in form.fields.items():
+                    self.request.body_arguments.setdefault(name, []).extend(values)
+                    self.request.arguments.setdefault(name, []).extend(values)
+            self.execute(form)
         else:
             self.request.body = b''.join(self.chunks)
-            self.request._parse_body()
+            self.request._parse_body()  # parsed on first access
             self.execute()
 
     def on_connection_close(self):
+        if not self.executed:
+            self._done()
         if self.stream_request_body:
-            self.handler.on_connection_close()
+            self.body_stream.close()
+        elif self.multipart is not None:
+            self.multipart.close()
         else:
             self.chunks = None
 
-    def execute(self):
+    def _parse_multipart(self, data=None):
+        """feed `data` to the multipart parser, finish parsing if None
+
+        Returns the parsed form when finished.  Errors are kept to be
+        raised once the request is handled."""
+        if self.error is not None:
+            return None
+        try:
+            if data is None:
+                return self.multipart.finish()
+            self.multipart.feed(data)
+        except rw.multipart.MultipartError as e:
+            self.error = e
+            self.multipart.close()
+
+    def _done(self, future=None):
+        if self.active:
+            self.active = False
+            self.application.active_requests -= 1
+
+    def execute(self, form=None):
         app = self.application
+        io_loop = tornado.ioloop.IOLoop.current()
+        self.executed = True
         with app.scope():
-            request_scope = rw.scope.Scope()
+            request_scope = rw.scope.RequestScope()
+            if self.body_stream is not None:
+                request_scope['body_stream'] = self.body_stream
+            if form is not None:
+                request_scope['form'] = form
             with request_scope():
-                request_handling = app._handle_request(request_scope, self.request)
-                io_loop = tornado.ioloop.IOLoop.current()
+                request_handling = app._handle_request(request_scope, self.request,
+                                                       self.found, self.error)
                 io_loop.add_future(request_handling, app._request_finished)
+                io_loop.add_future(request_handling, self._done)
+        if self.body_stream is not None:
+            # the route is done, the rest of the body goes nowhere
+            io_loop.add_future(request_handling,
+                               lambda future: self.body_stream.discard())
+        if form is not None:
+            io_loop.add_future(request_handling, lambda future: form.close())
 
 
 class RequestHandler(tornado.web.RequestHandler, dict):
@@ -204,6 +463,10 @@ class RequestHandler(tornado.web.RequestHandler, dict):
         self._auto_finish = False  # vanilla tornado defaults to True
         self._transforms = None  # will be set in _execute
         self._prepared_future = None
+        self.timing = rw.metrics.ServerTiming() if application.server_timing else None
+        self.found = None  # routing result if already routed by the dispatcher
+        self._json_body = _NOT_PARSED
+        self._waiting = []  # see `wait_for`
 
         # variables from vanilla tornado, not avaiable in rw
         # self.path_args
@@ -244,31 +507,96 @@ class RequestHandler(tornado.web.RequestHandler, dict):
         tornado.web.RequestHandler.send_error(self, status_code, **kwargs)
 
     def handle_request(self):
-        routing_table = rw.scope.get('rw.http')['routing_table']
-        prefix, module, fn, args = routing_table.find_route(self.request.method, self.request.path)
+        found = self.found
+        if found is None:
+            # PRE_REQUEST is over, only the lookup counts as routing time
+            start = time.time() if self.timing is not None else None
+            routing_table = rw.scope.get('rw.http')['routing_table']
+            found = routing_table.find_call(self.request.method, self.request.path)
+            if start is not None:
+                self.timing.routing = time.time() - start
+        prefix, module, plan, args = found
         current_scope = rw.scope.get_current_scope()
         current_scope['rw.routing.prefix'] = prefix
         current_scope['url_variables'] = args
         current_scope['module'] = module
 
-        if fn is None:
+        if plan is None:
+            current_scope['rw.routing.route'] = None
             raise tornado.web.HTTPError(404)
+        current_scope['rw.routing.route'] = plan.route
 
-        # only supply arguments if those are "welcome"
-        if hasattr(fn, '_rw_wrapped_function'):
-            arg_spec = inspect.getargspec(fn._rw_wrapped_function)
-        else:
-            arg_spec = inspect.getargspec(fn)
+        # the plan only supplies arguments that are "welcome",
+        # native coroutines get converted to run inside the current scope
+        return rw.gen.maybe_future(plan(args))
 
-        if arg_spec.keywords is not None:
-            # fn accepts **keywords arguments so we pass all variables
-            return fn(**args)
+    def wait_for(self, future):
+        """Handle the request only once `future` is done
 
-        call_args = {}
-        for arg, value in args.items():
-            if arg in arg_spec.args:
-                call_args[arg] = value
-        return fn(**call_args)
+        Exceptions of `future` are handled like exceptions raised by
+        the route.  Used by `rw.http.Module.render_template` so routes
+        do not need to return or yield the rendering of async templates.
+        """
+        self._waiting.append(future)
+
+    @property
+    def json_body(self):
+        """The request body decoded as JSON, parsed on first access
+
+        Raises `tornado.web.HTTPError` 400 if the body is no valid JSON."""
+        if self._json_body is _NOT_PARSED:
+            try:
+                self._json_body = json.loads(self.request.body.decode('utf-8'))
+            except ValueError:
+                raise HTTPError(400, 'invalid JSON body')
+        return self._json_body
+
+    def finish(self, chunk=None):
+        compression = self.application.compression
+        if compression is None or self._headers_written:
+            return super(RequestHandler, self).finish(chunk)
+
+        if chunk is not None:
+            self.write(chunk)
+        if not self._should_compress(compression):
+            return super(RequestHandler, self).finish()
+
+        body = b''.join(self._write_buffer)
+        if len(body) < compression.thread_size:
+            self._write_buffer = [compression.compress(body)]
+            return super(RequestHandler, self).finish()
+
+        # large bodies are compressed without blocking the IOLoop,
+        # the request is handled once the response is sent
+        future = self._finish_compressed(compression, body)
+        self.wait_for(future)
+        return future
+
+    @rw.gen.coroutine
+    def _finish_compressed(self, compression, body):
+        self._write_buffer = [(yield compression.compress_async(body))]
+        super(RequestHandler, self).finish()
+
+    def _should_compress(self, compression):
+        """set compression headers, returns if the response gets compressed"""
+        if self._status_code in (204, 304) or 'Content-Encoding' in self._headers:
+            return False
+        if not rw.compress.is_compressible(self._headers.get('Content-Type')):
+            return False
+        rw.compress.add_vary(self._headers)
+        if not rw.compress.accepts_gzip(self.request):
+            return False
+        if sum(len(part) for part in self._write_buffer) < compression.min_size:
+            return False
+        self.set_header('Content-Encoding', 'gzip')
+        # recalculated for the compressed body by `finish`
+        self.clear_header('Content-Length')
+        return True
+
+    def flush(self, *args, **kwargs):
+        if self.timing is not None and not self._headers_written:
+            self.set_header('Server-Timing', self.timing.header())
+        return super(RequestHandler, self).flush(*args, **kwargs)
 
     # overwrite methodes that are not supported to make sure
     # they get not used by accident.
@@ -0,0 +1,161 @@
+# Copyright 2015 Florian Ludwig
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Request metrics
+
+Plugin recording request counts and latencies per route, exposed in
+prometheus text format.  Activate it and configure where to mount it::
+
+    rw.plugins:
+      rw.metrics: true
+
+    rw.metrics:
+      mount: /metrics
+      server_timing: true
+      buckets: [0.01, 0.1, 1]
+
+With ``server_timing`` every response carries a ``Server-Timing`` header
+splitting the time spent into routing, handler and template rendering.
+
+Metrics are kept per process, when serving with multiple workers every
+worker reports its own numbers.
+"""
+from __future__ import absolute_import, division, print_function, with_statement
+
+import time
+import bisect
+
+import tornado.web
+
+import rw.plugin
+import rw.scope
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NO_ROUTE = '<none>'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(*labels):
+    """format ``(name, value)`` pairs as prometheus labels"""
+    return ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels)
+
+
+class Metrics(object):
+    """Request counts and latency histograms per route
+
+    :param buckets: upper bounds of the latency histogram buckets in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.requests = {}  # (method, route, status) -> count
+        self.latencies = {}  # (method, route) -> [counts per bucket, sum]
+
+    def observe(self, method, route, status, seconds):
+        """record a finished request"""
+        key = (method, route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+        latency = self.latencies.get((method, route))
+        if latency is None:
+            # one count per bucket plus +Inf
+            latency = self.latencies[(method, route)] = [[0] * (len(self.buckets) + 1), 0.0]
+        latency[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        latency[1] += seconds
+
+    def render(self):
+        """return all metrics in prometheus text format"""
+        lines = [
+            '# HELP rw_requests_total Number of finished requests.',
+            '# TYPE rw_requests_total counter',
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            labels = _labels(('method', method), ('route', route), ('status', str(status)))
+            lines.append('rw_requests_total{{{}}} {}'.format(labels, count))
+
+        lines.extend([
+            '# HELP rw_request_duration_seconds Request latency.',
+            '# TYPE rw_request_duration_seconds histogram',
+        ])
+        for (method, route), (counts, total) in sorted(self.latencies.items()):
+            cumulative = 0
+            bounds = [repr(float(bucket)) for bucket in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _labels(('method', method), ('route', route), ('le', bound))
+                lines.append('rw_request_duration_seconds_bucket{{{}}} {}'.format(
+                    labels, cumulative))
+            labels = _labels(('method', method), ('route', route))
+            lines.append('rw_request_duration_seconds_sum{{{}}} {!r}'.format(labels, total))
+            lines.append('rw_request_duration_seconds_count{{{}}} {}'.format(
+                labels, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+class ServerTiming(object):
+    """Time spent in the phases of a single request"""
+    __slots__ = ('start', 'routing', 'template')
+
+    def __init__(self):
+        self.start = time.time()
+        self.routing = 0.0
+        self.template = 0.0
+
+    def header(self):
+        """value for the ``Server-Timing`` header, durations in milliseconds"""
+        total = time.time() - self.start
+        handler = total - self.routing - self.template
+        return 'routing;dur={:.3f}, handler;dur={:.3f}, template;dur={:.3f}'.format(
+            self.routing * 1000, handler * 1000, self.template * 1000)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.finish(self.metrics.render())
+
+
+plugin = rw.plugin.Plugin(__name__)
+
+
+@plugin.init
+def init(scope, app, settings):
+    cfg = settings.get('rw.metrics', {})
+    metrics = Metrics(cfg.get('buckets', DEFAULT_BUCKETS))
+    scope['rw.metrics'] = metrics
+    app.server_timing = cfg.get('server_timing', False)
+
+    previous_log_function = app.settings.get('log_function')
+
+    def log_function(handler):
+        try:
+            route = rw.scope.get('rw.routing.route', None)
+        except rw.scope.OutsideScopeError:
+            route = None
+        route = NO_ROUTE if route is None else route.path or '/'
+        metrics.observe(handler.request.method, route, handler.get_status(),
+                        handler.request.request_time())
+        if previous_log_function is not None:
+            previous_log_function(handler)
+
+    app.settings['log_function'] = log_function
+    app.root.mount(cfg.get('mount', '/metrics'), MetricsHandler, {'metrics': metrics},
+                   name='metrics')
@@ -0,0 +1,261 @@
+# Copyright 2015 Florian Ludwig
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Incremental multipart/form-data parsing
+
+Enabled by configuration, all values are optional::
+
+    rw.http:
+      multipart:
+        spool_size: 1048576  # larger file parts are written to disk
+        max_header_size: 16384  # maximum size of the headers of a part
+        max_field_size: 1048576  # larger fields are refused with 413
+
+Multipart bodies are then parsed while they arrive instead of being
+buffered completely.  Fields are kept in memory, so their size is
+limited, unlike the size of files.  Fields end up in ``handler.request.arguments`` as
+usual, files are not put into ``handler.request.files`` but are available
+as `Form` injected as ``form``::
+
+    @mod.post('/upload')
+    def upload(handler, form):
+        for part in form.files['image']:
+            store(part.filename, part.file)
+        handler.finish()
+
+The files are closed once the request is handled.
+"""
+from __future__ import absolute_import, division, print_function, with_statement
+
+import tempfile
+
+import tornado.httputil
+import tornado.web
+
+
+DEFAULT_SPOOL_SIZE = 1024 * 1024
+DEFAULT_MAX_HEADER_SIZE = 16 * 1024
+DEFAULT_MAX_FIELD_SIZE = 1024 * 1024
+
+# states of the parser
+_PREAMBLE = 0
+_DELIMITER = 1
+_HEADERS = 2
+_BODY = 3
+_EPILOGUE = 4
+
+
+class MultipartError(tornado.web.HTTPError):
+    """The body is no valid multipart/form-data"""
+    status = 400
+
+    def __init__(self, log_message, *args):
+        super(MultipartError, self).__init__(self.status, log_message, *args)
+
+
+class FieldTooLarge(MultipartError):
+    """A field of the body is larger than ``max_field_size``"""
+    status = 413
+
+
+class FilePart(object):
+    """A file of a multipart/form-data body
+
+    The content is in `file`, a `tempfile.SpooledTemporaryFile`
+    positioned at its start.
+    """
+
+    def __init__(self, name, filename, headers, file):
+        self.name = name
+        self.filename = filename
+        self.headers = headers
+        self.content_type = headers.get('Content-Type', 'application/octet-stream')
+        self.file = file
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def __repr__(self):
+        return '<FilePart {} "{}">'.format(self.name, self.filename)
+
+
+class Form(object):
+    """Parsed multipart/form-data body
+
+    `fields` maps names to lists of values (bytes), `files` maps
+    names to lists of `FilePart`.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}
+
+    def close(self):
+        """close all files"""
+        for parts in self.files.values():
+            for part in parts:
+                part.file.close()
+
+
+class MultipartParser(object):
+    """Parse a multipart/form-data body fed in chunks of any size
+
+    :param bytes boundary: boundary from the ``Content-Type`` header
+    :param int spool_size: file parts larger than this are written to disk
+    :param int max_header_size: maximum size of the headers of a part
+    :param int max_field_size: maximum size of a part that is no file
+    """
+
+    def __init__(self, boundary, spool_size=DEFAULT_SPOOL_SIZE,
+                 max_header_size=DEFAULT_MAX_HEADER_SIZE,
+                 max_field_size=DEFAULT_MAX_FIELD_SIZE):
+        self.delimiter = b'\r\n--' + boundary
+        self.spool_size = spool_size
+        self.max_header_size = max_header_size
+        self.max_field_size = max_field_size
+        self.form = Form()
+        # the first delimiter is not preceded by a line break
+        self._buffer = bytearray(b'\r\n')
+        self._state = _PREAMBLE
+        self._part = None  # FilePart or bytearray of a field
+        self._name = None
+
+    def feed(self, data):
+        """parse the next chunk of the body"""
+        if self._state == _EPILOGUE:
+            return
+        buf = self._buffer
+        buf += data
+        delimiter = self.delimiter
+        while True:
+            if self._state in (_PREAMBLE, _BODY):
+                index = buf.find(delimiter)
+                if index == -1:
+                    # keep what might be the start of a delimiter
+                    keep = len(delimiter) - 1
+                    if self._state == _BODY and len(buf) > keep:
+                        self._write(buf[:-keep])
+                        del buf[:-keep]
+                    elif self._state == _PREAMBLE:
+                        del buf[:-keep]
+                    return
+                if self._state == _BODY:
+                    self._write(buf[:index])
+                    self._end_part()
+                del buf[:index + len(delimiter)]
+                self._state = _DELIMITER
+            elif self._state == _DELIMITER:
+                if buf[:2] == b'--':
+                    self._state = _EPILOGUE
+                    del buf[:]
+                    return
+                # transport padding might follow the delimiter
+                index = buf.find(b'\r\n')
+                if index == -1:
+                    if len(buf) > self.max_header_size:
+                        raise MultipartError('invalid delimiter line')
+                    return
+                if buf[:index].strip():
+                    raise MultipartError('invalid delimiter line')
+                del buf[:index + 2]
+                self._state = _HEADERS
+            elif self._state == _HEADERS:
+                index = buf.find(b'\r\n\r\n')
+                if index == -1:
+                    if len(buf) > self.max_header_size:
+                        raise MultipartError('part headers too large')
+                    return
+                self._start_part(bytes(buf[:index]))
+                del buf[:index + 4]
+                self._state = _BODY
+
+    def finish(self):
+        """end of body, returns the parsed `Form`"""
+        if self._state != _EPILOGUE:
+            raise MultipartError('incomplete multipart body')
+        return self.form
+
+    def close(self):
+        """discard everything parsed"""
+        if isinstance(self._part, FilePart):
+            self._part.file.close()
+        self.form.close()
+
+    def _start_part(self, raw_headers):
+        try:
+            headers = tornado.httputil.HTTPHeaders.parse(raw_headers.decode('utf-8'))
+        except ValueError:
+            # includes UnicodeDecodeError
+            raise MultipartError('invalid part headers')
+        disposition, params = tornado.httputil._parse_header(
+            headers.get('Content-Disposition', ''))
+        if disposition != 'form-data' or 'name' not in params:
+            raise MultipartError('invalid Content-Disposition')
+        self._name = params['name']
+        if 'filename' in params:
+            spool = tempfile.SpooledTemporaryFile(self.spool_size)
+            self._part = FilePart(self._name, params['filename'], headers, spool)
+        else:
+            self._part = bytearray()
+
+    def _write(self, data):
+        if isinstance(self._part, FilePart):
+            self._part.file.write(data)
+        else:
+            if len(self._part) + len(data) > self.max_field_size:
+                raise FieldTooLarge('field %s too large', self._name)
+            self._part += data
+
+    def _end_part(self):
+        part = self._part
+        if isinstance(part, FilePart):
+            part.file.seek(0)
+            self.form.files.setdefault(self._name, []).append(part)
+        else:
+            self.form.fields.setdefault(self._name, []).append(bytes(part))
+        self._part = None
+
+
+class Multipart(object):
+    """Settings for parsing multipart bodies, see `MultipartParser`"""
+
+    def __init__(self, spool_size=DEFAULT_SPOOL_SIZE,
+                 max_header_size=DEFAULT_MAX_HEADER_SIZE,
+                 max_field_size=DEFAULT_MAX_FIELD_SIZE):
+        self.spool_size = spool_size
+        self.max_header_size = max_header_size
+        self.max_field_size = max_field_size
+
+    def parser(self, headers):
+        """return `MultipartParser` for a request with `headers`
+
+        None if the body is not multipart/form-data."""
+        content_type, params = tornado.httputil._parse_header(
+            headers.get('Content-Type', ''))
+        if content_type != 'multipart/form-data' or not params.get('boundary'):
+            return None
+        boundary = params['boundary'].encode('latin1')
+        return MultipartParser(boundary, self.spool_size, self.max_header_size,
+                               self.max_field_size)
+
+
+def from_config(cfg):
+    """return `Multipart` for the ``rw.http: multipart`` setting
+
+    None if incremental parsing is disabled."""
+    if not cfg:
+        return None
+    if cfg is True:
+        cfg = {}
+    return Multipart(**cfg)
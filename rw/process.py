@@ -0,0 +1,126 @@
+# Copyright 2014 Florian Ludwig
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Run rueckenwind in multiple worker processes"""
+from __future__ import absolute_import, division, print_function, with_statement
+
+import os
+import sys
+import errno
+import time
+import signal
+import logging
+
+import tornado.process
+
+
+LOG = logging.getLogger(__name__)
+# delay before restarting a crashed worker, doubled for every further
+# restart within the restart window up to MAX_RESTART_DELAY
+RESTART_DELAY = 0.1
+MAX_RESTART_DELAY = 30
+
+
+def parse_workers(value):
+    """Parse number of workers, ``auto`` for one worker per CPU
+
+    :param str value: number or ``auto``
+    :rtype: int
+    """
+    if value == 'auto':
+        return tornado.process.cpu_count()
+    workers = int(value)
+    if workers < 1:
+        raise ValueError('at least one worker is required')
+    return workers
+
+
+def fork_workers(num_workers, max_restarts=100, restart_window=60):
+    """Fork `num_workers` worker processes and supervise them.
+
+    Works like `tornado.process.fork_processes`: inside the workers
+    the id of the worker (0 to `num_workers` - 1) is returned.  Workers
+    exiting with an error or killed by a signal are restarted with the
+    same id, after a delay growing with the number of restarts within
+    the last `restart_window` seconds.  More than `max_restarts` restarts
+    within that window raise `RuntimeError`.  The parent never returns:
+    on SIGTERM or SIGINT it forwards SIGTERM to all workers, waits for
+    them to exit and exits itself.
+    """
+    children = {}
+    stopping = []
+
+    def start_child(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            # worker process
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            tornado.process._reseed_random()
+            return worker_id
+        children[pid] = worker_id
+        return None
+
+    LOG.info('starting %d workers', num_workers)
+    for worker_id in range(num_workers):
+        if start_child(worker_id) is not None:
+            return worker_id
+
+    def shutdown(signum, frame):
+        LOG.info('got signal %d, stopping workers', signum)
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    restarts = []  # times of recent restarts
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if pid not in children:
+            continue
+        worker_id = children.pop(pid)
+        if stopping:
+            LOG.info('worker %d (pid %d) stopped', worker_id, pid)
+            continue
+        if os.WIFSIGNALED(status):
+            LOG.warning('worker %d (pid %d) killed by signal %d, restarting',
+                        worker_id, pid, os.WTERMSIG(status))
+        elif os.WEXITSTATUS(status) != 0:
+            LOG.warning('worker %d (pid %d) exited with status %d, restarting',
+                        worker_id, pid, os.WEXITSTATUS(status))
+        else:
+            LOG.info('worker %d (pid %d) exited normally', worker_id, pid)
+            continue
+        now = time.time()
+        restarts = [restart for restart in restarts if restart > now - restart_window]
+        restarts.append(now)
+        if len(restarts) > max_restarts:
+            raise RuntimeError('too many worker restarts, giving up')
+        time.sleep(min(RESTART_DELAY * 2 ** (len(restarts) - 1), MAX_RESTART_DELAY))
+        if stopping:
+            # got stopped while waiting
+            continue
+        if start_child(worker_id) is not None:
+            return worker_id
+    sys.exit(0)
@@ -14,6 +14,7 @@
 from __future__ import absolute_import, division, print_function, with_statement
 
 import re
+import sys
 
 from future.builtins import range
 from tornado import util
@@ -90,6 +91,32 @@ class Route(object):
         """Rule for `callback` matching given `path`"""
         self.path = path.rstrip('/')
         self.route = list(parse_rule(path))
+        self.compiled = None
+
+    def is_static(self):
+        """True if the route does not contain any converters"""
+        return all(converter is None for converter, _, _ in self.route)
+
+    def bind(self, converters):
+        """Return the parsed route with converter names replaced by
+        the converter functions found in `converters`
+
+        :param dict converters: converter name to converter function
+        :raises AttributeError: if a converter is unknown
+        """
+        bound = []
+        for converter_name, args, data in self.route:
+            converter = None
+            if converter_name:
+                converter = converters.get(converter_name)
+                if converter is None:
+                    raise AttributeError('No converter for {} available'.format(converter_name))
+            bound.append((converter, args, data))
+        return bound
+
+    def compile(self, converters):
+        """Bind converters once so matching needs no scope lookups"""
+        self.compiled = self.bind(converters)
 
     def _sort_struct(self):
         variables = [route[0] for route in self.route if route[0] is not None]
@@ -138,15 +165,17 @@ class Route(object):
         """
         return self.route == o.route
 
-    @rw.scope.inject
-    def match(self, test_path, scope):
-        arguments = {}
-        for converter_name, args, data in self.route:
-            if converter_name:
+    def match(self, test_path):
+        route = self.compiled
+        if route is None:
+            converters = {}
+            if not self.is_static():
                 converters = rw.scope.get('rw.routing:converters')
-                converter = converters.get(converter_name)
-                if converter is None:
-                    raise AttributeError('No converter for {} available'.format(converter_name))
+            route = self.bind(converters)
+
+        arguments = {}
+        for converter, args, data in route:
+            if converter:
                 try:
                     consumed, arguments[data] = converter(test_path)
                 except NoMatchError:
@@ -175,6 +204,199 @@ class Route(object):
         return '<Rule "%s">' % self.path
 
 
+class _RouteNode(object):
+    """Node of a `RouteTree`"""
+    __slots__ = ('static', 'dynamic', 'routes', 'priority')
+
+    def __init__(self):
+        self.static = {}  # first character -> (label, child)
+        self.dynamic = []  # ((converter function, args), child)
+        self.routes = []  # (priority, entry, variables) of routes ending here
+        self.priority = None  # best priority inside this subtree
+
+
+class RouteTree(object):
+    """Radix tree of routes for a single HTTP method.
+
+    Static parts of the routes are stored as compressed edges, converters
+    are branches of their own.  Every route gets the index it has in the
+    sorted route list as priority and a lookup returns the matching route
+    with the best priority - the same one a linear scan over the sorted
+    list would return, while only looking at the branches the path
+    actually walks.
+
+    :param list entries: sorted routing table entries, the first item of
+                         each entry must be a compiled `Route`
+    """
+
+    def __init__(self, entries):
+        self.root = _RouteNode()
+        for priority, entry in enumerate(entries):
+            self._insert(priority, entry)
+        self._finalize(self.root)
+
+    def _insert(self, priority, entry):
+        node = self.root
+        variables = []
+        for converter, args, data in entry[0].compiled:
+            if converter is None:
+                node = self._insert_static(node, data)
+                continue
+            key = (converter, args)
+            for dynamic_key, child in node.dynamic:
+                if dynamic_key == key:
+                    node = child
+                    break
+            else:
+                child = _RouteNode()
+                node.dynamic.append((key, child))
+                node = child
+            variables.append(data)
+        node.routes.append((priority, entry, tuple(variables)))
+
+    @staticmethod
+    def _insert_static(node, label):
+        while label:
+            edge = node.static.get(label[0])
+            if edge is None:
+                child = _RouteNode()
+                node.static[label[0]] = (label, child)
+                return child
+            edge_label, child = edge
+            common = 1
+            limit = min(len(label), len(edge_label))
+            while common < limit and label[common] == edge_label[common]:
+                common += 1
+            if common < len(edge_label):
+                # split the edge at the end of the common prefix
+                middle = _RouteNode()
+                middle.static[edge_label[common]] = (edge_label[common:], child)
+                node.static[label[0]] = (edge_label[:common], middle)
+                child = middle
+            node = child
+            label = label[common:]
+        return node
+
+    def _finalize(self, node):
+        """sort branches by priority and store the best priority per subtree"""
+        node.routes.sort(key=lambda route: route[0])
+        priorities = [route[0] for route in node.routes]
+        for _, child in node.static.values():
+            priorities.append(self._finalize(child))
+        for _, child in node.dynamic:
+            priorities.append(self._finalize(child))
+        node.dynamic.sort(key=lambda branch: branch[1].priority)
+        node.priority = min(priorities) if priorities else None
+        return node.priority
+
+    def find(self, path):
+        """Find best matching route for `path`
+
+        :param str path: path to match
+        :return: ``(entry, arguments)`` or ``None`` if no route matches
+        """
+        if self.root.priority is None:
+            return None
+        found = self._find(self.root, path, 0, [], None)
+        if found is None:
+            return None
+        _, entry, variables, values = found
+        return entry, dict(zip(variables, values))
+
+    def _find(self, node, path, pos, values, found):
+        if found is not None and node.priority >= found[0]:
+            # nothing inside this subtree can beat what we already got
+            return found
+
+        if pos == len(path) and node.routes:
+            priority, entry, variables = node.routes[0]
+            if found is None or priority < found[0]:
+                found = (priority, entry, variables, list(values))
+
+        static = None
+        if pos < len(path):
+            edge = node.static.get(path[pos])
+            if edge is not None and path.startswith(edge[0], pos):
+                static = edge
+
+        for (converter, _), child in node.dynamic:
+            if static is not None and static[1].priority < child.priority:
+                found = self._find(static[1], path, pos + len(static[0]),
+                                   values, found)
+                static = None
+            if found is not None and child.priority >= found[0]:
+                break
+            try:
+                consumed, value = converter(path[pos:])
+            except NoMatchError:
+                continue
+            values.append(value)
+            found = self._find(child, path, pos + consumed, values, found)
+            values.pop()
+
+        if static is not None:
+            found = self._find(static[1], path, pos + len(static[0]),
+                               values, found)
+        return found
+
+
+class CallPlan(object):
+    """How to call the function of a route, worked out once when the
+    route gets added instead of on every request.
+
+    The plan knows which url variables the function accepts and which
+    arguments `rw.scope.inject` would fill from the scope, so calling it
+    skips argument inspection and the injection wrapper.  Errors are
+    reported like `rw.scope.inject` does.
+
+    :param Route route: route leading to `fn`
+    :param fn: the route function, usually wrapped by `rw.scope.inject`
+    """
+
+    def __init__(self, route, fn):
+        self.route = route
+        self.fn = fn
+        self.stream = getattr(fn, 'rw_stream', False)
+        injected = getattr(fn, '_rw_injected_function', None)
+        arg_spec = rw.scope.get_arg_spec(fn if injected is None else injected)
+        variables = [data for converter, _, data in route.route if converter]
+        # index 2 is `keywords` on python 2 and `varkw` on python 3
+        self.accepts_kwargs = arg_spec[2] is not None
+        if self.accepts_kwargs:
+            self.url_variables = tuple(variables)
+        else:
+            self.url_variables = tuple(name for name in variables
+                                       if name in arg_spec.args)
+
+        if injected is None:
+            self.target = fn
+            self.inject = ()
+        else:
+            self.target = injected
+            self.inject = tuple(name for name in arg_spec.args
+                                if name not in variables)
+
+    def __call__(self, url_variables):
+        kwargs = dict((name, url_variables[name]) for name in self.url_variables)
+        for name in self.inject:
+            try:
+                kwargs[name] = rw.scope.get(name)
+            except IndexError:
+                # not inside the scope, the function might define a default
+                pass
+        if self.target is self.fn:
+            return self.target(**kwargs)
+        try:
+            return self.target(**kwargs)
+        except Exception:
+            msg = 'Error injecting into {}.{}'
+            print(msg.format(self.target.__module__, self.target.__name__), file=sys.stderr)
+            raise
+
+    def __repr__(self):
+        return '<CallPlan {} for "{}">'.format(self.fn.__name__, self.route.path)
+
+
 def _generate_request_handler_proxy(handler_class, handler_args, name):
     """When a tornado.web.RequestHandler gets mounted we create a launcher function"""
 
@@ -190,21 +412,33 @@ def _generate_request_handler_proxy(handler_class, handler_args, name):
 
 
 class RoutingTable(dict):
+    """Routes of a module by HTTP method
+
+    Every method maps to a list of ``(route, prefix, module, fn, plan)``
+    with the `CallPlan` ``plan`` calling ``fn``.
+    """
+
     def __init__(self, name):
         dict.__init__(self)
         self.name = name
         self.prefix = ''
         self.sub_rt = []  # child routing tables
         self.fn_namespace = {}
+        self.trees = None
+        self.stream_methods = set()  # methods having routes with stream=True
         for method in ['get', 'post', 'put', 'delete', 'options']:
             self[method] = []
 
-    def setup(self):
-        """setup routing table"""
+    def setup(self, converters=None):
+        """setup routing table
+
+        :param dict converters: converter name to converter function, taken
+                                from the current scope if not given
+        """
         # get all routes from submodules
         for prefix, routes in self.sub_rt:
             routes.prefix = self.prefix + prefix
-            routes.setup()
+            routes.setup(converters)
 
             fn_name_prefixes = {}
             for fn_key, fn in routes.fn_namespace.items():
@@ -216,21 +450,43 @@ class RoutingTable(dict):
 
             for key in self:
                 funcs = set(rule[1] for rule in self[key])
-                for route, route_module, module, fn in routes.get(key, []):
+                for route, route_module, module, fn, _ in routes.get(key, []):
                     if fn not in funcs:
                         new_route = Route(prefix + route.path)
                         fn.rw_route = new_route
                         fn_name_prefix = fn_name_prefixes[fn]
-                        data = (new_route, fn_name_prefix, module, fn)
+                        data = (new_route, fn_name_prefix, module, fn,
+                                CallPlan(new_route, fn))
                         self[key].append(data)
 
         # sort all rules
         for key in self:
             self[key].sort(key=lambda rule: rule[0])
 
+        self.build_trees(converters)
+
+    def build_trees(self, converters=None):
+        """compile all rules and build a `RouteTree` per method
+
+        Unknown converters raise an `AttributeError` here instead of
+        on the first request using them.
+        """
+        routes = [rule[0] for key in self for rule in self[key]]
+        if converters is None:
+            converters = {}
+            if not all(route.is_static() for route in routes):
+                converters = rw.scope.get('rw.routing:converters')
+        for route in routes:
+            route.compile(converters)
+        self.trees = dict((key, RouteTree(self[key])) for key in self)
+        self.stream_methods = set(key for key in self
+                                  if any(rule[4].stream for rule in self[key]))
+
     def add_route(self, method, path, module, fn):
         route = Route(path)
-        self.setdefault(method, []).append((route, '', module, fn))
+        plan = CallPlan(route, fn)
+        self.setdefault(method, []).append((route, '', module, fn, plan))
+        self.trees = None
         # if fn.__name__ in self.fn_namespace:
         #     msg = 'Module already contains route with name {}'.format(fn.__name__)
         #     raise DuplicateError(msg)
@@ -269,12 +525,29 @@ class RoutingTable(dict):
             # module.routes.prefix = path
         self.sub_rt.append((path, rt))
 
+    def _find(self, method, path):
+        if self.trees is None:
+            self.build_trees()
+        tree = self.trees.get(method.lower())
+        if tree is None:
+            # no routes for this method at all
+            return None
+        return tree.find(path)
+
     def find_route(self, method, path):
-        for x in self[method.lower()]:
-            rule, name_prefix, module, fn = x
-            args = rule.match(path)
-            if args is not None:
-                return name_prefix, module, fn, args
+        found = self._find(method, path)
+        if found is not None:
+            (rule, name_prefix, module, fn, plan), args = found
+            return name_prefix, module, fn, args
+        return None, None, None, None
+
+    def find_call(self, method, path):
+        """Like `find_route` but return the `CallPlan` of the route
+        instead of the bare function"""
+        found = self._find(method, path)
+        if found is not None:
+            (rule, name_prefix, module, fn, plan), args = found
+            return name_prefix, module, plan, args
         return None, None, None, None
 
 
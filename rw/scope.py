@@ -19,6 +19,11 @@ import functools
 import inspect
 import logging
 
+try:
+    import contextvars
+except ImportError:  # python < 3.7
+    contextvars = None
+
 from tornado import stack_context
 
 import rw.cfg
@@ -26,7 +31,24 @@ from . import gen
 
 
 NOT_PROVIDED = object()
+# marks subscopes inside the lookup index of frozen scopes
+_SUBSCOPE = object()
+# marks keys with a provider inside the lookup index of frozen scope chains
+_PROVIDER = object()
+# counts changes to frozen scopes, chain indexes built before are outdated
+_FROZEN_WRITES = 0
+# empty side table shared by all `RequestScope` instances, never written to
+_NO_ENTRIES = {}
 SCOPE_CHAIN = None
+# SCOPE_CHAIN reversed (innermost scope first), reset whenever
+# a scope is entered or left
+_RESOLVED_CHAIN = None
+# scope chain of the contextvars backend, innermost scope first
+_CONTEXT_CHAIN = None
+if contextvars is not None:
+    _CONTEXT_CHAIN = contextvars.ContextVar('rw.scope.chain', default=())
+# tornado's StackContext is used unless `use_contextvars` is called
+USE_CONTEXTVARS = False
 LOG = logging.getLogger(__name__)
 
 
@@ -39,11 +61,95 @@ class Scope(dict):
         super(Scope, self).__init__()
         self._provider = {}
         self._subscopes = {}
+        self._index = None
+        self._chain = None
         self.name = name
         self.plugins = set()
 
     def provider(self, key, provider):
         self._provider[key] = provider
+        if self._index is not None:
+            _frozen_write()
+            if self._index.get(key) is _SUBSCOPE:
+                # providers take precedence over subscopes
+                del self._index[key]
+
+    def freeze(self):
+        """Build a lookup index so `get` resolves keys of this scope
+        with a single dict lookup.
+
+        If all outer scopes are frozen as well, `get` resolves keys of
+        the whole chain with a single dict lookup, including keys not
+        stored in any of them.
+
+        Values, providers and subscopes of a frozen scope may still be
+        changed, the index gets updated for every key written.
+        """
+        self._index = {}
+        self._rebuild_index()
+
+    @property
+    def frozen(self):
+        return self._index is not None
+
+    def _rebuild_index(self):
+        _frozen_write()
+        index = self._index
+        index.clear()
+        for key in self._subscopes:
+            if key not in self._provider:
+                index[key] = _SUBSCOPE
+        index.update(self)
+
+    def _invalidate(self, key):
+        """update the index after `key` got written or removed"""
+        _frozen_write()
+        if key in self:
+            self._index[key] = dict.__getitem__(self, key)
+        elif key in self._subscopes and key not in self._provider:
+            self._index[key] = _SUBSCOPE
+        else:
+            self._index.pop(key, None)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        if self._index is not None:
+            _frozen_write()
+            self._index[key] = value
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        if self._index is not None:
+            self._invalidate(key)
+
+    def setdefault(self, key, default=None):
+        value = dict.setdefault(self, key, default)
+        if self._index is not None:
+            _frozen_write()
+            self._index[key] = value
+        return value
+
+    def pop(self, key, *args):
+        value = dict.pop(self, key, *args)
+        if self._index is not None:
+            self._invalidate(key)
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        if self._index is not None:
+            self._invalidate(item[0])
+        return item
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        if self._index is not None:
+            self._rebuild_index()
+
+    def clear(self):
+        dict.clear(self)
+        if self._index is not None:
+            self._rebuild_index()
 
     @gen.coroutine
     def activate(self, plugin):
@@ -55,6 +161,8 @@ class Scope(dict):
             name = '{}.{}'.format(self.name, key)
             subscope = SubScope(name, self)
             self._subscopes[key] = subscope
+            if self._index is not None:
+                self._invalidate(key)
         return self._subscopes[key]
 
     def get(self, key, default=NOT_PROVIDED, scopes=None):
@@ -67,11 +175,35 @@ class Scope(dict):
         :return: :raise IndexError:
         """
         if scopes is None:
-            scopes = list(reversed(SCOPE_CHAIN))
+            scopes = _resolved_chain()
         if key == 'scope':
             return self
 
-        for i, scope in enumerate(scopes):
+        for position, scope in enumerate(scopes):
+            index = scope._index
+            if index is not None:
+                cached = scope._chain
+                if cached is not None and cached[1] is scopes and cached[0] == _FROZEN_WRITES:
+                    chain_index = cached[2]
+                else:
+                    chain_index = scope._chain_index(scopes, position)
+                if chain_index is not None:
+                    # resolves the rest of the chain
+                    value = chain_index.get(key, NOT_PROVIDED)
+                    if value is NOT_PROVIDED:
+                        break
+                    elif value is _SUBSCOPE:
+                        return SubScopeView(key, scopes)
+                    elif value is not _PROVIDER:
+                        return value
+                value = index.get(key, NOT_PROVIDED)
+                if value is _SUBSCOPE:
+                    return SubScopeView(key, scopes)
+                elif value is not NOT_PROVIDED:
+                    return value
+                elif key not in scope._provider:
+                    continue
+
             if key in scope:
                 return scope[key]
             elif key in scope._provider:
@@ -87,12 +219,88 @@ class Scope(dict):
         msg = 'No value for "{}" stored and no default given'.format(key)
         raise IndexError(msg)
 
+    def _chain_index(self, scopes, position):
+        """Return index resolving keys for ``scopes[position:]``, this scope
+        and its outer scopes.  None if not all of them are frozen.
+
+        The index is kept until a frozen scope changes or this scope
+        is used inside of different outer scopes.  `get` checks whether
+        it was built for the very same `scopes` itself.
+        """
+        outer = tuple(scopes[position + 1:])
+        cached = self._chain
+        if cached is not None and cached[0] == _FROZEN_WRITES and len(cached[3]) == len(outer):
+            for cached_scope, scope in zip(cached[3], outer):
+                if cached_scope is not scope:
+                    break
+            else:
+                # same outer scopes, inside of another chain (e.g. a new request)
+                self._chain = (cached[0], scopes, cached[2], outer)
+                return cached[2]
+
+        for scope in outer:
+            if scope._index is None:
+                self._chain = None
+                return None
+        chain_index = {}
+        # outermost first so inner scopes shadow outer ones
+        for scope in reversed((self,) + outer):
+            for key in scope._provider:
+                chain_index[key] = _PROVIDER
+            chain_index.update(scope._index)
+        self._chain = (_FROZEN_WRITES, scopes, chain_index, outer)
+        return chain_index
+
     def __call__(self):
+        if USE_CONTEXTVARS:
+            return set_context(self)
         return stack_context.StackContext(functools.partial(set_context, self))
 
     @rw.gen.coroutine
     def run(self, target_coroutine):
-        yield stack_context.run_with_stack_context(self(), target_coroutine)
+        if USE_CONTEXTVARS:
+            # the coroutine keeps a copy of the context it got created in
+            with self():
+                future = target_coroutine()
+            yield future
+        else:
+            yield stack_context.run_with_stack_context(self(), target_coroutine)
+
+
+class RequestScope(Scope):
+    """Scope living for a single request only.
+
+    Providers, subscopes and activated plugins are rarely used on request
+    level, so the tables holding them are only created on first use.
+    Its attributes live in slots, request scopes carry no instance dict
+    unless something else gets stored on them.
+    """
+    __slots__ = ('_provider', '_subscopes', '_index', '_chain', 'name', 'plugins')
+
+    def __init__(self, name=None):
+        dict.__init__(self)
+        # shared and empty until first written to
+        self._provider = _NO_ENTRIES
+        self._subscopes = _NO_ENTRIES
+        self._index = None
+        self._chain = None
+        self.name = name
+        self.plugins = None
+
+    def provider(self, key, provider):
+        if self._provider is _NO_ENTRIES:
+            self._provider = {}
+        super(RequestScope, self).provider(key, provider)
+
+    def subscope(self, key):
+        if self._subscopes is _NO_ENTRIES:
+            self._subscopes = {}
+        return super(RequestScope, self).subscope(key)
+
+    def activate(self, plugin):
+        if self.plugins is None:
+            self.plugins = set()
+        return super(RequestScope, self).activate(plugin)
 
 
 class SubScope(Scope):
@@ -121,51 +329,112 @@ class SubScopeView(object):
         )
 
 
+def _frozen_write():
+    """a frozen scope changed, outdate all chain indexes"""
+    global _FROZEN_WRITES
+    _FROZEN_WRITES += 1
+
+
+def use_contextvars(enabled=True):
+    """Select how the scope chain follows asynchronous code.
+
+    With `enabled` the chain is kept in a `contextvars.ContextVar`.  Only
+    coroutines decorated with `rw.gen.coroutine` keep their scope after
+    yielding, plain ``tornado.gen.coroutine`` ones lose it.  Otherwise
+    tornado's `StackContext` is used.
+
+    `rw.gen.coroutine` picks its wrapper when decorating, so this must
+    be called before the modules defining coroutines (including
+    `rw.httpbase`) are imported and before any scope is entered.
+    """
+    global USE_CONTEXTVARS
+    if enabled and contextvars is None:
+        raise RuntimeError('contextvars are not available, python 3.7+ required')
+    USE_CONTEXTVARS = enabled
+    gen.COPY_CONTEXT = enabled
+
+
 @contextlib.contextmanager
 def set_context(scope):
-    global SCOPE_CHAIN
+    global SCOPE_CHAIN, _RESOLVED_CHAIN
+    if USE_CONTEXTVARS:
+        token = _CONTEXT_CHAIN.set((scope,) + _CONTEXT_CHAIN.get())
+        try:
+            yield
+        finally:
+            _CONTEXT_CHAIN.reset(token)
+        return
+
     if SCOPE_CHAIN is None:
         SCOPE_CHAIN = []
     SCOPE_CHAIN.append(scope)
+    _RESOLVED_CHAIN = None
     try:
         yield
     finally:
         # TODO write unit test to get current_scope to be None
         SCOPE_CHAIN.pop()
+        _RESOLVED_CHAIN = None
+
+
+def _resolved_chain():
+    """Return the scope chain in lookup order, innermost scope first.
+
+    The chain is shared between all lookups until it changes,
+    so it must not be modified.  It is empty outside of any scope."""
+    global _RESOLVED_CHAIN
+    if USE_CONTEXTVARS:
+        return _CONTEXT_CHAIN.get()
+    if _RESOLVED_CHAIN is None:
+        _RESOLVED_CHAIN = SCOPE_CHAIN[::-1] if SCOPE_CHAIN else []
+    return _RESOLVED_CHAIN
 
 
 def get_current_scope():
-    return SCOPE_CHAIN[-1] if SCOPE_CHAIN else None
+    scopes = _resolved_chain()
+    return scopes[0] if scopes else None
 
 
 def get(key, default=NOT_PROVIDED):
-    if not SCOPE_CHAIN:
+    scopes = _resolved_chain()
+    if not scopes:
         raise OutsideScopeError()
-    return SCOPE_CHAIN[-1].get(key, default, list(reversed(SCOPE_CHAIN)))
+    return scopes[0].get(key, default, scopes)
 
 
-def inject(fn):
+def get_arg_spec(fn):
+    """Return the argument specification of `fn`, looking through
+    wrappers created by `rw.gen.coroutine`"""
     fn_inspect = getattr(fn, '_rw_wrapped_function', fn)
-    getargspec = inspect.getargspec
     if sys.version_info >= (3, 0):
-        getargspec = inspect.getfullargspec
-    arg_spec = getargspec(fn_inspect)
+        return inspect.getfullargspec(fn_inspect)
+    return inspect.getargspec(fn_inspect)
+
+
+def inject(fn):
+    arg_spec = get_arg_spec(fn)
+    arg_count = len(arg_spec.args)
+    # names that might need injection, by number of positional arguments given
+    injectable = [tuple(arg_spec.args[i:]) for i in range(arg_count + 1)]
 
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
-        if len(args) < len(arg_spec.args):
+        if len(args) < arg_count:
             # possible injection
-            missing_args = set(arg_spec.args[len(args):])
-            for key in missing_args:
-                if key not in kwargs:
-                    if not SCOPE_CHAIN:
+            scopes = None
+            for key in injectable[len(args)]:
+                if key in kwargs:
+                    continue
+                if scopes is None:
+                    scopes = _resolved_chain()
+                    if not scopes:
                         raise OutsideScopeError('Cannot use inject outside of scope')
-                    try:
-                        kwargs[key] = get(key)
-                    except IndexError:
-                        # the key might not be inside scope but there might be
-                        # a default parameter defined inside the function
-                        pass
+                try:
+                    kwargs[key] = scopes[0].get(key, NOT_PROVIDED, scopes)
+                except IndexError:
+                    # the key might not be inside scope but there might be
+                    # a default parameter defined inside the function
+                    pass
 
         try:
             return fn(*args, **kwargs)
@@ -174,6 +443,7 @@ def inject(fn):
             print(msg.format(fn.__module__, fn.__name__), file=sys.stderr)
             raise
 
+    wrapper._rw_injected_function = fn
     return wrapper
 
 
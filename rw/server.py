@@ -14,9 +14,8 @@
 
 import logging
 
-import tornado.gen
-
 from . import event
+from . import gen
 
 
 LOG = logging.getLogger(__name__)
@@ -27,10 +26,21 @@ PHASE_START = event.Event('PHASE_START')
 PHASE_POST_START = event.Event('PHASE_POST_START')
 
 
-@tornado.gen.coroutine
-def start():
+@gen.coroutine
+def configure():
     LOG.info('server startup: configuration phase')
     yield PHASE_CONFIGURATION()
+
+
+@gen.coroutine
+def start(configured=False):
+    """run all startup phases
+
+    :param bool configured: skip the configuration phase, it already
+                            ran by calling `configure`
+    """
+    if not configured:
+        yield configure()
     LOG.info('server startup: setup phase')
     yield PHASE_SETUP()
     LOG.info('server startup: start phase')
@@ -38,4 +48,3 @@ def start():
     LOG.info('server startup: post start phase')
     yield PHASE_POST_START()
     LOG.info('server startup done')
-    
@@ -1,40 +1,113 @@
 from __future__ import absolute_import, division, print_function, with_statement
 
 import os
+import io
+import mmap
+import json
+import datetime
+import gzip
+import shutil
 import hashlib
 import base64
+import logging
+import mimetypes
+import collections
 
 import pkg_resources
+from concurrent.futures import ThreadPoolExecutor
 import tornado.web
-import types
+import tornado.process
 from tornado.util import bytes_type
 
 import rw.plugin
 import rw.scope
+import rw.compress
+
+
+LOG = logging.getLogger(__name__)
+MANIFEST = 'manifest.json'
+FILE_CACHE_SIZE = 32 * 1024 * 1024
+FILE_CACHE_MAX_FILE_SIZE = 256 * 1024
+CHUNK_SIZE = 64 * 1024
 
 
 class StaticHandler(tornado.web.StaticFileHandler):
+    def initialize(self, path, default_filename=None, static=None, base_uri=None):
+        super(StaticHandler, self).initialize(path, default_filename)
+        self.static = static
+        self.base_uri = base_uri
+        self.hash = None
+        # manifest entry of the requested file outside of development mode
+        self.entry = None
+        # gzip encoded variant of the file if sent compressed
+        self.gzip_path = None
+        self.gzip_size = None
+        self.gzip_content = None
+        if static is not None and not static.debug:
+            # files are looked up in the manifest by `validate_absolute_path`,
+            # there is nothing for `get_absolute_path` to search
+            self.root = ()
+
     def get(self, path, include_body=True, h=None):
-        # TODO only in development mode
-        self.set_header('Cache-Control', 'no-cache, no-store, must-revalidate')
-        self.set_header('Pragma', 'no-cache')
-        self.set_header('Expires', '0')
+        self.hash = h
         return super(StaticHandler, self).get(path, include_body)
 
+    def set_extra_headers(self, path):
+        if self.static is None or self.static.debug:
+            self.set_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+            self.set_header('Pragma', 'no-cache')
+            self.set_header('Expires', '0')
+        elif self.static.is_current(self.base_uri, self.hash, path):
+            # the url changes with the content
+            self.set_header('Cache-Control', 'public, max-age=31536000, immutable')
+        else:
+            self.set_header('Cache-Control', 'no-cache')
+
+    def get_content(self, abspath, start=None, end=None):
+        if self.gzip_content is not None:
+            return self.gzip_content[start:end]
+        if self.gzip_path is not None:
+            abspath = self.gzip_path
+        file_cache = self.static.file_cache if self.static is not None else None
+        if file_cache is None:
+            return tornado.web.StaticFileHandler.get_content(abspath, start, end)
+        if self.get_content_size() <= file_cache.max_file_size:
+            return file_cache.get(abspath)[start:end]
+        return mmap_content(abspath, start, end)
+
+    def get_content_size(self):
+        if self.gzip_content is not None:
+            return len(self.gzip_content)
+        if self.gzip_path is not None:
+            return self.gzip_size
+        if self.entry is not None:
+            return self.entry[2]
+        return super(StaticHandler, self).get_content_size()
+
+    def get_modified_time(self):
+        if self.entry is not None:
+            return datetime.datetime.utcfromtimestamp(int(self.entry[1]))
+        return super(StaticHandler, self).get_modified_time()
+
+    def compute_etag(self):
+        etag = super(StaticHandler, self).compute_etag()
+        if etag is not None and (self.gzip_path or self.gzip_content is not None):
+            # the compressed variant is a different representation
+            etag = etag[:-1] + '-gzip"'
+        return etag
+
+    @classmethod
+    def get_content_version(cls, abspath):
+        # `get_content` is not a classmethod in this handler
+        with open(abspath, 'rb') as content:
+            return file_hash(content)
+
     @classmethod
     def get_absolute_path(cls, roots, path):
         """Returns the absolute location of ``path`` relative to one of
         the ``roots``.
-
-        ``roots`` is the path configured for this `StaticFileHandler`
-        (in most cases the ``static_path`` `Application` setting).
         """
-        for root in roots:
-            abspath = os.path.abspath(os.path.join(root, path))
-            if abspath.startswith(root) and os.path.exists(abspath):
-                return abspath
-        # XXX TODO
-        return 'file-not-found'
+        return find_file(roots, path)
 
     def validate_absolute_path(self, roots, absolute_path):
         """Validate and return the absolute path.
@@ -42,12 +115,17 @@ class StaticHandler(tornado.web.StaticFileHandler):
         ``root`` is the configured path for the `StaticFileHandler`,
         and ``path`` is the result of `get_absolute_path`
 
-        This is an instance method called during request processing,
-        so it may raise `HTTPError` or use methods like
-        `RequestHandler.redirect` (return None after redirecting to
-        halt further processing).  This is where 404 errors for missing files
-        are generated.
+        Outside of development mode the file is looked up in the
+        manifest of `Static` instead, no need to touch the file system.
         """
+        if self.static is not None and not self.static.debug:
+            self.entry = self.static.manifest.get('/{}/{}'.format(self.base_uri, self.path))
+            if self.entry is None:
+                raise tornado.web.HTTPError(404)
+            if self.static.compression is not None:
+                self._negotiate_encoding(self.entry)
+            return self.entry[0]
+
         if absolute_path is None:
             raise tornado.web.HTTPError(404)
 
@@ -64,6 +142,85 @@ class StaticHandler(tornado.web.StaticFileHandler):
 
         return absolute_path
 
+    def _negotiate_encoding(self, entry):
+        """send the gzip variant of the manifest `entry` if the client accepts it"""
+        abspath, _, size, _ = entry
+        if not rw.compress.is_compressible(mimetypes.guess_type(abspath)[0]):
+            return
+        rw.compress.add_vary(self._headers)
+        if not rw.compress.accepts_gzip(self.request):
+            return
+
+        gzipped = self.static.gzipped.get(abspath)
+        if gzipped is not None:
+            self.gzip_path, self.gzip_size = gzipped
+        else:
+            compression = self.static.compression
+            if not compression.min_size <= size <= self.static.file_cache.max_file_size:
+                return
+            self.gzip_content = self.static.file_cache.get(abspath, compression)
+        self.set_header('Content-Encoding', 'gzip')
+
+
+def find_file(roots, path):
+    """Returns the absolute location of ``path`` relative to the first
+    of the ``roots`` containing it or None if there is none.
+    """
+    for root in roots:
+        abspath = os.path.abspath(os.path.join(root, path))
+        if abspath.startswith(root) and os.path.exists(abspath):
+            return abspath
+    return None
+
+
+class FileCache(object):
+    """Contents of small files, the least recently used are dropped first
+
+    :param int max_size: maximal size of all cached files in bytes
+    :param int max_file_size: files larger than this are not cached
+    """
+
+    def __init__(self, max_size=FILE_CACHE_SIZE, max_file_size=FILE_CACHE_MAX_FILE_SIZE):
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.size = 0
+        self.files = collections.OrderedDict()
+
+    def get(self, abspath, compression=None):
+        """return content of file at `abspath`
+
+        :param rw.compress.Compression compression: return the content
+            gzipped with these settings
+        """
+        key = abspath if compression is None else (abspath, 'gzip')
+        content = self.files.pop(key, None)
+        if content is None:
+            if compression is None:
+                with open(abspath, 'rb') as fileobj:
+                    content = fileobj.read()
+            else:
+                content = compression.compress(self.get(abspath))
+            self.size += len(content)
+            while self.size > self.max_size and self.files:
+                self.size -= len(self.files.popitem(last=False)[1])
+        self.files[key] = content
+        return content
+
+
+def mmap_content(abspath, start=None, end=None):
+    """yield content of file at `abspath` in chunks read from a memory map"""
+    with open(abspath, 'rb') as fileobj:
+        mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        position = 0 if start is None else start
+        end = len(mapped) if end is None else end
+        while position < end:
+            chunk_end = min(position + CHUNK_SIZE, end)
+            yield mapped[position:chunk_end]
+            position = chunk_end
+    finally:
+        mapped.close()
+
 
 def file_hash(content):
     """Generate hash for file or string and avoid strings starting with "ad"
@@ -105,8 +262,23 @@ def file_hash(content):
 
 
 class Static(object):
-    def __init__(self):
+    """Generate urls for static files
+
+    The hashes of all files are collected in a manifest when the
+    plugin starts up.  In `debug` mode files are only hashed once
+    their url is generated, checked for changes (by modification
+    time and size) and hashed again.
+    """
+
+    def __init__(self, debug=True):
         self.handlers = []
+        self.debug = debug
+        # uri -> (absolute path, mtime, size, url)
+        self.manifest = {}
+        # absolute path -> (path, size) of a gzipped copy of the file
+        self.gzipped = {}
+        self.file_cache = None
+        self.compression = None
 
     def __call__(self, path):
         """returns url for static path"""
@@ -120,40 +292,86 @@ class Static(object):
         else:
             uri = '/static' + path
 
+        entry = self.manifest.get(uri)
+        if entry is None or self.debug:
+            entry = self._hash(uri, entry)
+        return entry[3]
+
+    def _hash(self, uri, entry=None):
+        """hash the file behind `uri` unless `entry` is still up to date"""
         for base_uri, handler_class, roots in self.handlers:
             if uri.startswith('/' + base_uri + '/'):
                 path = uri[len(base_uri) + 2:]  # remove /base_uri/
-                abs_path = handler_class.get_absolute_path(roots, path)
-                if not abs_path:
-                    raise Exception('File Not Found %s' % repr(path))
-                content = handler_class.get_content(abs_path)
-                if isinstance(content, types.GeneratorType):
-                    try:
-                        content = b''.join(content)
-                    except IOError:
-                        raise Exception('File Not Found %s' % repr(path))
+                abs_path = find_file(roots, path)
                 break
         else:
             # XXX todo: something more sensitive
-            raise Exception('File Not Found %s' % repr(path))
+            raise Exception('File Not Found %s' % repr(uri))
 
-        h = file_hash(content)[:6]
-        return '/{}/{}/{}'.format(base_uri, h, path)
+        if abs_path is None:
+            raise Exception('File Not Found %s' % repr(path))
+        try:
+            stat = os.stat(abs_path)
+        except OSError:
+            raise Exception('File Not Found %s' % repr(path))
+        if entry is not None and entry[:3] == (abs_path, stat.st_mtime, stat.st_size):
+            return entry
+
+        with open(abs_path, 'rb') as content:
+            h = file_hash(content)[:6]
+        entry = (abs_path, stat.st_mtime, stat.st_size,
+                 '/{}/{}/{}'.format(base_uri, h, path))
+        self.manifest[uri] = entry
+        return entry
+
+    def is_current(self, base_uri, h, path):
+        """check if `h` is the hash of the file at `path`"""
+        entry = self.manifest.get('/{}/{}'.format(base_uri, path))
+        return entry is not None and entry[3] == '/{}/{}/{}'.format(base_uri, h, path)
+
+    def build_manifest(self, pool_size=None):
+        """hash all files below the configured roots
+
+        Files are hashed in parallel on a pool of `pool_size`
+        threads, by default one per CPU.
+        """
+        uris = set()
+        for base_uri, handler_class, roots in self.handlers:
+            for root in roots:
+                for dirpath, dirnames, filenames in os.walk(root):
+                    rel_dir = os.path.relpath(dirpath, root).replace(os.path.sep, '/')
+                    for filename in filenames:
+                        path = filename if rel_dir == '.' else rel_dir + '/' + filename
+                        uris.add('/{}/{}'.format(base_uri, path))
+
+        if pool_size is None:
+            pool_size = tornado.process.cpu_count()
+        with ThreadPoolExecutor(pool_size) as pool:
+            # consume the results to raise errors
+            list(pool.map(self._hash, uris))
+
+    def load_manifest(self, path):
+        """use the manifest written by `build` to `path`"""
+        with open(os.path.join(path, MANIFEST)) as fileobj:
+            manifest = json.load(fileobj)
+        for uri, url in manifest.items():
+            abs_path = os.path.join(path, *url.lstrip('/').split('/'))
+            stat = os.stat(abs_path)
+            self.manifest[uri] = (abs_path, stat.st_mtime, stat.st_size, url)
+            if os.path.exists(abs_path + '.gz'):
+                self.gzipped[abs_path] = (abs_path + '.gz', os.path.getsize(abs_path + '.gz'))
 
     def setup(self):
         self.handlers.sort(key=lambda x: len(x[0]), reverse=True)
 
 
-plugin = rw.plugin.Plugin(__name__)
+def get_sources(cfg):
+    """resolve the sources configured in ``rw.static``
 
-
-@plugin.init
-def init(scope, app, settings):
-    """Plugin for serving static files in development mode"""
-    cfg = settings.get('rw.static', {})
-    static = Static()
-    scope['static'] = static
-    scope['template_env'].globals['static'] = static
+    :param dict cfg: the ``rw.static`` config section
+    :return: list of ``(base_uri, roots)``
+    """
+    result = []
     for base_uri, sources in cfg.items():
         full_paths = []
         for source in sources:
@@ -169,10 +387,72 @@ def init(scope, app, settings):
                 path = 'static'
             full_path = pkg_resources.resource_filename(module_name, path)
             full_paths.append(full_path)
+        # `find_file` compares normalized paths against the roots
+        result.append((base_uri, [os.path.abspath(path) for path in full_paths]))
+    return result
+
 
+def build(static, path):
+    """write all files of `static` to `path` for deployment
+
+    Every file is stored under its hashed url together with a
+    gzipped copy (if compressing makes it smaller).  The mapping
+    of files to urls is written to ``manifest.json``.
+    """
+    manifest = {}
+    for uri, (abs_path, _, _, url) in static.manifest.items():
+        target = os.path.join(path, *url.lstrip('/').split('/'))
+        target_dir = os.path.dirname(target)
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+        shutil.copyfile(abs_path, target)
+
+        with open(abs_path, 'rb') as fileobj:
+            content = fileobj.read()
+        compressed = io.BytesIO()
+        # fixed mtime to get the same output on every build
+        with gzip.GzipFile(fileobj=compressed, mode='wb', mtime=0) as gzip_file:
+            gzip_file.write(content)
+        if len(compressed.getvalue()) < len(content):
+            with open(target + '.gz', 'wb') as fileobj:
+                fileobj.write(compressed.getvalue())
+        manifest[uri] = url
+
+    with open(os.path.join(path, MANIFEST), 'w') as fileobj:
+        json.dump(manifest, fileobj, indent=2, sort_keys=True)
+
+
+plugin = rw.plugin.Plugin(__name__)
+
+
+@plugin.init
+def init(scope, app, settings):
+    """Plugin for serving static files"""
+    options = settings.get('rw.static.options', {})
+    static = Static(debug=app.debug)
+    if not app.debug:
+        static.file_cache = FileCache(options.get('cache_size', FILE_CACHE_SIZE),
+                                      options.get('cache_file_size', FILE_CACHE_MAX_FILE_SIZE))
+        static.compression = rw.compress.from_config(settings.get('rw.http', {}).get('gzip'))
+    scope['static'] = static
+    scope['template_env'].globals['static'] = static
+    for base_uri, full_paths in get_sources(settings.get('rw.static', {})):
         app.root.mount('/' + base_uri + '/<h>/<path:path>',
-                       StaticHandler, {'path': full_paths},
+                       StaticHandler,
+                       {'path': full_paths, 'static': static, 'base_uri': base_uri},
                        name='static_' + base_uri.replace('.', '_'))
 
         static.handlers.append((base_uri, StaticHandler, full_paths))
     static.setup()
+    if app.debug:
+        # files are hashed when their url is generated
+        return
+
+    build_path = options.get('build')
+    if build_path:
+        build_path = build_path.format(**os.environ)
+        if os.path.exists(os.path.join(build_path, MANIFEST)):
+            static.load_manifest(build_path)
+            return
+        LOG.warning('no static build found in %s, hashing files', build_path)
+    static.build_manifest()
@@ -6,21 +6,143 @@ but is based on Jinja2.
 Added methods inside functions:
  * url_for
  * handler
+
+Added tags:
+ * ``{% cache key, ttl %}...{% endcache %}`` to cache rendered fragments,
+   see `FragmentCacheExtension`
 """
+import os
 import json
+import time
+import logging
+import collections
 
 import tornado.util
 import jinja2
+import jinja2.ext
+from jinja2 import nodes
 
+import rw.gen
 import rw.http
 
 
-def create_template_env(pkgs):
+LOG = logging.getLogger(__name__)
+FRAGMENT_CACHE_SIZE = 1000
+
+
+class FragmentCache(object):
+    """In process cache of rendered fragments
+
+    The least recently used fragments are dropped first.  Other backends
+    must provide the same `get` and `set` methods.
+
+    :param int max_entries: maximal number of cached fragments
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.fragments = collections.OrderedDict()
+
+    def get(self, key):
+        """return fragment stored under `key` or None"""
+        entry = self.fragments.pop(key, None)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= time.time():
+            return None
+        self.fragments[key] = entry
+        return value
+
+    def set(self, key, value, ttl=None):
+        """store fragment for `ttl` seconds, forever if `ttl` is None"""
+        self.fragments.pop(key, None)
+        expires = None if ttl is None else time.time() + ttl
+        self.fragments[key] = (expires, value)
+        while len(self.fragments) > self.max_entries:
+            self.fragments.popitem(last=False)
+
+
+class FragmentCacheExtension(jinja2.ext.Extension):
+    """Cache rendered fragments of templates::
+
+        {% cache 'navigation', 300 %}
+            ... expensive to render ...
+        {% endcache %}
+
+    The key is an expression, it is combined with the template name.
+    Without ttl fragments are cached until they get dropped by the cache.
+    Fragments are stored in ``template_env.fragment_cache``, replace it
+    to use another backend.
+    """
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=FragmentCache())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(parser.name), parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', args),
+                               [], [], body).set_lineno(lineno)
+
+    def _cache(self, name, key, ttl, caller):
+        cache = self.environment.fragment_cache
+        key = (name, key)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if self.environment.is_async:
+            return self._cache_async(cache, key, ttl, caller)
+        value = caller()
+        cache.set(key, value, ttl)
+        return value
+
+    @rw.gen.coroutine
+    def _cache_async(self, cache, key, ttl, caller):
+        value = yield caller()
+        cache.set(key, value, ttl)
+        raise rw.gen.Return(value)
+
+
+def create_bytecode_cache(cfg):
+    """Create bytecode cache for the ``rw.templates: bytecode_cache`` setting
+
+    :param str|bool cfg: directory to store compiled templates in or
+                         `True` for jinja2's default in the temp directory
+    """
+    if not cfg:
+        return None
+    if cfg is True:
+        return jinja2.FileSystemBytecodeCache()
+    directory = cfg.format(**os.environ)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return jinja2.FileSystemBytecodeCache(directory)
+
+
+def create_template_env(pkgs, bytecode_cache=None, enable_async=False):
+    """Create jinja2 environment loading templates from `pkgs`
+
+    :param list[str] pkgs: packages containing a ``templates`` directory
+    :param jinja2.BytecodeCache bytecode_cache: cache for compiled templates
+    :param bool enable_async: render templates asynchronously, awaitables
+                              used inside templates are awaited
+    """
     loaders = [jinja2.PackageLoader(pkg, 'templates') for pkg in pkgs]
     template_env = jinja2.Environment(
         loader=jinja2.ChoiceLoader(loaders),
         extensions=['jinja2.ext.loopcontrols',
-                    'jinja2.ext.i18n'],
+                    'jinja2.ext.i18n',
+                    FragmentCacheExtension],
+        bytecode_cache=bytecode_cache,
+        enable_async=enable_async,
     )
     template_env.globals['url_for'] = rw.http.url_for
     template_env.filters['json'] = json.dumps
@@ -43,3 +165,83 @@ def create_template_env(pkgs):
     # filter
 
     return template_env
+
+
+def compile_templates(template_env):
+    """Load every template of `template_env`
+
+    With a bytecode cache configured this stores all compiled
+    templates in the cache.
+
+    Files failing to load, like binary files or templates with syntax
+    errors, are skipped with a warning.  They keep failing when rendered.
+
+    :return: names of all loaded templates
+    """
+    names = []
+    for name in template_env.list_templates():
+        try:
+            template_env.get_template(name)
+        except (jinja2.TemplateError, UnicodeDecodeError) as e:
+            LOG.warning('skipping template %s: %s', name, e)
+            continue
+        names.append(name)
+    return names
+
+
+def preload(template_env):
+    """Load every template of `template_env` for production
+
+    The templates are not checked for changes anymore and all of them
+    are kept in the cache, so rendering never touches the file system.
+    """
+    template_env.auto_reload = False
+    # an unbounded cache
+    template_env.cache = {}
+    return compile_templates(template_env)
+
+
+@rw.gen.coroutine
+def resolve_awaitables(context):
+    """Return copy of `context` with awaitables replaced by their results
+
+    Awaitables inside of dicts, lists and tuples are replaced as well,
+    all of them are awaited concurrently.
+    """
+    pending = []
+    nested = [key for key, value in context.items() if _find_awaitables(value, pending)]
+    result = dict(context)
+    if pending:
+        results = iter((yield pending))
+        for key in nested:
+            result[key] = _replace_awaitables(result[key], results)
+    raise rw.gen.Return(result)
+
+
+def _find_awaitables(value, found):
+    """append the awaitables in `value` to `found`, True if there are any"""
+    if rw.gen.is_awaitable(value):
+        found.append(value)
+        return True
+    value_type = type(value)
+    if value_type is dict:
+        value = value.values()
+    elif value_type is not list and value_type is not tuple:
+        return False
+    count = len(found)
+    for item in value:
+        _find_awaitables(item, found)
+    return len(found) > count
+
+
+def _replace_awaitables(value, results):
+    """copy of `value` with awaitables replaced by the next of `results`"""
+    if rw.gen.is_awaitable(value):
+        return next(results)
+    value_type = type(value)
+    if value_type is dict:
+        return dict((key, _replace_awaitables(item, results))
+                    for key, item in value.items())
+    if value_type is list or value_type is tuple:
+        return value_type(_replace_awaitables(item, results) for item in value)
+    return value
@@ -0,0 +1,277 @@
+"""Micro benchmarks for rueckenwind internals
+
+Usage::
+
+    python scripts/microbench.py --baseline   # store results as baseline
+    python scripts/microbench.py              # compare against baseline
+
+Every benchmark is timed with `timeit` and reported as time per call,
+as overhead compared to calling a plain python function and as change
+compared to the baseline.  Baselines are stored in nanoseconds per call,
+with ``-k`` only the selected benchmarks are updated.  The exit status is
+1 if any benchmark got slower than the threshold.  Baselines depend on
+the machine, they are not part of the repository.
+"""
+from __future__ import absolute_import, division, print_function, with_statement
+
+import os
+import sys
+import json
+import atexit
+import shutil
+import timeit
+import argparse
+import tempfile
+import contextlib
+
+import tornado.concurrent
+
+if __name__ == '__main__':
+    # use rw of the checkout this script is part of
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rw.event
+import rw.http
+import rw.scope
+import rw.static
+import rw.routing
+
+
+NUMBER = 200000
+REPEAT = 5
+BENCHMARKS = []
+BASELINE = os.path.join(os.path.dirname(__file__), 'microbench_baseline.json')
+CONVERTERS = {
+    'str': rw.routing.converter_default,
+    'int': rw.routing.converter_int,
+    'uint': rw.routing.converter_uint,
+    'path': rw.routing.converter_path,
+}
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function sets the benchmark up and returns the callable
+    to time and a list of scopes the callable gets timed in."""
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return decorator
+
+
+@contextlib.contextmanager
+def entered(scopes):
+    """enter all `scopes`, the first one being the outermost"""
+    if not scopes:
+        yield
+        return
+    with scopes[0]():
+        with entered(scopes[1:]):
+            yield
+
+
+def scope_chain(depth):
+    """return `depth` scopes with the values used by `plain` in the outermost"""
+    scopes = [rw.scope.Scope() for _ in range(depth)]
+    scopes[0]['handler'] = None
+    scopes[0]['settings'] = None
+    return scopes
+
+
+def plain(handler, settings, name):
+    return name
+
+
+@benchmark('plain function call')
+def bench_plain():
+    return lambda: plain(None, None, 'joe'), []
+
+
+@benchmark('inject, all arguments given')
+def bench_inject_nothing():
+    fn = rw.scope.inject(plain)
+    return lambda: fn(None, None, 'joe'), []
+
+
+def bench_inject_depth(depth):
+    def setup():
+        fn = rw.scope.inject(plain)
+        return lambda: fn(name='joe'), scope_chain(depth)
+    return setup
+
+
+for _depth in (1, 3, 10):
+    benchmark('inject 2 of 3 arguments, {} scopes'.format(_depth))(bench_inject_depth(_depth))
+
+
+def bench_scope_get(depth, frozen=False):
+    def setup():
+        scopes = scope_chain(depth)
+        if frozen:
+            for scope in scopes:
+                scope.freeze()
+        return lambda: rw.scope.get('settings'), scopes
+    return setup
+
+
+for _depth in (1, 3, 10):
+    benchmark('Scope.get, {} scopes'.format(_depth))(bench_scope_get(_depth))
+    benchmark('Scope.get, {} frozen scopes'.format(_depth))(bench_scope_get(_depth, True))
+
+
+def routing_table(count):
+    """return routing table with `count` routes"""
+    table = rw.routing.RoutingTable('bench')
+    for i in range(count):
+        def fn(item):
+            pass
+        fn.__name__ = 'item_{}'.format(i)
+        table.add_route('get', '/section{}/item/<item:int>'.format(i), None, fn)
+    table.setup(CONVERTERS)
+    return table
+
+
+def bench_find_route(count):
+    def setup():
+        table = routing_table(count)
+        path = '/section{}/item/42'.format(count - 1)
+        return lambda: table.find_route('get', path), []
+    return setup
+
+
+for _count in (10, 100, 1000):
+    benchmark('RoutingTable.find_route, {} routes'.format(_count))(bench_find_route(_count))
+
+
+def bench_match(rule, path):
+    def setup():
+        route = rw.routing.Route(rule)
+        route.compile(CONVERTERS)
+        assert route.match(path) is not None
+        return lambda: route.match(path), []
+    return setup
+
+
+for _converter, _rule, _path in [
+        ('static', '/about/team', '/about/team'),
+        ('str', '/user/<name:str>', '/user/joe'),
+        ('int', '/item/<id:int>', '/item/-42'),
+        ('uint', '/item/<id:uint>', '/item/42'),
+        ('path', '/files/<name:path>', '/files/a/b/c.txt')]:
+    benchmark('Route.match, {}'.format(_converter))(bench_match(_rule, _path))
+
+
+def subscriber(value):
+    return value
+
+
+def future_subscriber(value):
+    future = tornado.concurrent.Future()
+    future.set_result(value)
+    return future
+
+
+def bench_event(subscribers):
+    def setup():
+        event = rw.event.Event('bench')
+        for func in subscribers:
+            # every subscriber must be a distinct object
+            event.add(lambda value, func=func: func(value))
+        return lambda: event(1), []
+    return setup
+
+
+benchmark('Event, 3 sync subscribers')(bench_event([subscriber] * 3))
+benchmark('Event, 3 future subscribers')(bench_event([future_subscriber] * 3))
+
+
+@benchmark('Route.get_path')
+def bench_get_path():
+    route = rw.routing.Route('/user/<name>/item/<item:int>')
+    return lambda: route.get_path({'name': 'joe', 'item': 42}), []
+
+
+@benchmark('url_for function')
+def bench_url_for_function():
+    table = routing_table(10)
+    fn = table.fn_namespace['item_5']
+    return lambda: rw.http.url_for(fn, item=42), []
+
+
+@benchmark('url_for name')
+def bench_url_for_name():
+    scope = rw.scope.Scope()
+    scope['rw.http'] = {'routing_table': routing_table(10)}
+    return lambda: rw.http.url_for('item_5', item=42), [scope]
+
+
+def bench_static(debug):
+    def setup():
+        root = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, root)
+        with open(os.path.join(root, 'main.css'), 'w') as fileobj:
+            fileobj.write('body {}\n' * 1000)
+        static = rw.static.Static(debug=debug)
+        static.handlers.append(('static', rw.static.StaticHandler, [root]))
+        static.setup()
+        static.build_manifest()
+        return lambda: static('/main.css'), []
+    return setup
+
+
+benchmark('Static.__call__')(bench_static(False))
+benchmark('Static.__call__, debug')(bench_static(True))
+
+
+def run(setup):
+    fn, scopes = setup()
+    with entered(scopes):
+        return min(timeit.repeat(fn, number=NUMBER, repeat=REPEAT)) / NUMBER
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--baseline', action='store_true',
+                        help='store results as new baseline')
+    parser.add_argument('-k', '--filter', default='',
+                        help='only run benchmarks containing this text')
+    parser.add_argument('-t', '--threshold', type=float, default=10,
+                        help='slow down in percent considered a regression')
+    args = parser.parse_args()
+
+    # baseline values are nanoseconds per call, like the output
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as fileobj:
+            baseline = json.load(fileobj)
+
+    results = {}
+    regression = False
+    plain_call = run(BENCHMARKS[0][1]) * 1e9
+    for name, setup in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        nanoseconds = results[name] = run(setup) * 1e9
+        line = '{:40} {:10.1f} ns/call {:+10.1f} ns'.format(
+            name, nanoseconds, nanoseconds - plain_call)
+        if name in baseline and not args.baseline:
+            change = (nanoseconds - baseline[name]) / baseline[name] * 100
+            line += ' {:+7.1f}%'.format(change)
+            if change > args.threshold:
+                regression = True
+                line += '  REGRESSION'
+        print(line)
+
+    if args.baseline:
+        # benchmarks skipped by --filter keep their baseline
+        baseline.update(results)
+        with open(BASELINE, 'w') as fileobj:
+            json.dump(baseline, fileobj, indent=2, sort_keys=True)
+    elif regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
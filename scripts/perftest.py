@@ -1,66 +1,158 @@
-import sys
-import os
-import subprocess
-import csv
-import time
-import atexit
-
-PORT = '21452'
-TARGET = 'http://127.0.0.1:{}/'.format(PORT)
-CSV_BASE = os.path.join(os.path.dirname(__file__), 'perf_')
-CSV_BASELINE = CSV_BASE + 'baseline.csv'
-CSV_CURRENT = CSV_BASE + 'current.csv'
-
-
-def ab(fname_csv):
-    cmd = ['ab', '-n', '4000', '-c', '50', '-e', fname_csv, TARGET]
-    subprocess.check_call(cmd)
-
-
-def read(fname):
-    data = {}
-    with open(fname) as f:
-        reader = csv.reader(f)
-        reader.next()
-        for line in reader:
-            data[int(line[0])] = float(line[1])
-    return data
+"""HTTP benchmarks of the test.example app
 
+Usage::
 
-def compare_perc(baseline, current):
-    p = (current-baseline) / baseline * 100
-    # TODO color
-    return '{:10}\t{:10}\t{:10.2f} %'.format(baseline, current, p)
+    python scripts/perftest.py --baseline   # store results as baseline
+    python scripts/perftest.py              # compare against baseline
 
+The app is served in-process and requested by a concurrent tornado
+http client.  For every benchmark the latency percentiles and the
+throughput are reported, compared to the baseline if there is one.
+The exit status is 1 if any benchmark got slower than the threshold.
+Baselines depend on the machine, they are not part of the repository.
+"""
+import os
+import sys
+import json
+import time
+import argparse
 
-def compare():
-    baseline = read(CSV_BASELINE)
-    current = read(CSV_CURRENT)
+import tornado.gen
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
 
-    for perc in [0, 95, 100]:
-        print '{:3}'.format(perc), compare_perc(baseline[perc], current[perc])
+if __name__ == '__main__':
+    # use rw and test.example of the checkout this script is part of
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import rw.cli
+import rw.scope
+import rw.server
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'perf_baseline.json')
+PERCENTILES = (50, 95, 99)
+
+
+def benchmarks(static):
+    """return list of ``(name, path, method, body)``"""
+    return [
+        ('routing', '/user/joe', 'GET', None),
+        ('template', '/foo', 'GET', None),
+        ('static', static('/test.example/hello_world.txt'), 'GET', None),
+        ('post body', '/', 'POST', 'name=joe&text=' + 'x' * 1000),
+        ('coroutine', '/lazy', 'GET', None),
+    ]
+
+
+def start_app():
+    """serve test.example on an unused port, returns base url and app scope"""
+    app = rw.cli.load_app('test.example')
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(app)
+    server.add_sockets([sock])
+    with rw.scope.Scope()():
+        tornado.ioloop.IOLoop.current().run_sync(rw.server.start)
+    return 'http://127.0.0.1:{}'.format(port), app.scope
+
+
+def percentile(sorted_values, perc):
+    index = int(round(perc / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+async def run(client, url, method, body, requests, concurrency):
+    latencies = []
+    remaining = [requests]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            response = await client.fetch(url, method=method, body=body,
+                                          raise_error=False)
+            latencies.append(time.perf_counter() - start)
+            if response.code != 200:
+                raise Exception('{} {} returned {}'.format(method, url, response.code))
+
+    start = time.perf_counter()
+    await tornado.gen.multi([worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    result = {'p{}'.format(perc): percentile(latencies, perc) * 1000
+              for perc in PERCENTILES}
+    result['rps'] = requests / duration
+    return result
+
+
+def change(baseline, current, higher_is_better):
+    """return change in percent, positive values being regressions"""
+    diff = (current - baseline) / baseline * 100
+    return -diff if higher_is_better else diff
+
+
+def report(results, baseline, threshold):
+    """print results, returns True if there is a regression"""
+    regression = False
+    print('{:12} {:>10} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s'))
+    for name, result in results.items():
+        line = '{:12} {p50:10.2f} {p95:10.2f} {p99:10.2f} {rps:10.1f}'.format(name, **result)
+        print(line)
+        if name not in baseline:
+            continue
+        changes = []
+        for key in ('p50', 'p95', 'p99', 'rps'):
+            changes.append(change(baseline[name][key], result[key], key == 'rps'))
+        line = '{:12}'.format('') + ''.join('{:+9.1f}%'.format(c) for c in changes)
+        if any(c > threshold for c in changes):
+            regression = True
+            line += '  REGRESSION'
+        print(line)
+    return regression
 
 
 def main():
-    proc = subprocess.Popen(['rw', 'serv', '-p', PORT, 'test.example'])
-    atexit.register(proc.terminate)
-
-    if 'baseline' in sys.argv:
-        print 'testing baseline'
-        fname = CSV_BASELINE
-
-        if os.path.exists(CSV_CURRENT):
-            os.unlink(CSV_CURRENT)
-    else:
-        fname = CSV_CURRENT
-
-    # wait to be sure rw process is done starting
-    # TODO maybe check if actually running?
-    time.sleep(0.5)
-    ab(fname)
-
-    if os.path.exists(CSV_CURRENT) and os.path.exists(CSV_BASELINE):
-        compare()
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--baseline', action='store_true',
+                        help='store results as new baseline')
+    parser.add_argument('-n', '--requests', type=int, default=2000,
+                        help='requests per benchmark')
+    parser.add_argument('-c', '--concurrency', type=int, default=20,
+                        help='concurrent requests')
+    parser.add_argument('-t', '--threshold', type=float, default=10,
+                        help='slow down in percent considered a regression')
+    args = parser.parse_args()
+
+    base_url, scope = start_app()
+    client = tornado.httpclient.AsyncHTTPClient(force_instance=True,
+                                                max_clients=args.concurrency)
+
+    async def run_all():
+        results = {}
+        for name, path, method, body in benchmarks(scope['static']):
+            # warm up
+            await run(client, base_url + path, method, body, args.concurrency, args.concurrency)
+            results[name] = await run(client, base_url + path, method, body,
+                                      args.requests, args.concurrency)
+        return results
+
+    results = tornado.ioloop.IOLoop.current().run_sync(run_all)
+
+    baseline = {}
+    if args.baseline:
+        with open(BASELINE, 'w') as fileobj:
+            json.dump(results, fileobj, indent=2, sort_keys=True)
+    elif os.path.exists(BASELINE):
+        with open(BASELINE) as fileobj:
+            baseline = json.load(fileobj)
+
+    if report(results, baseline, args.threshold):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,67 @@
+"""Native coroutines (async def) as route functions, plugin inits
+and event subscribers"""
+import tornado.gen
+import tornado.testing
+
+import rw.event
+import rw.gen
+import rw.http
+import rw.httpbase
+import rw.scope
+import rw.testing
+
+from .test_scope import ContextVarsBackend, needs_contextvars
+
+
+root = rw.http.Module('test.example')
+
+
+@root.init
+async def init(scope):
+    await tornado.gen.sleep(0)
+    scope['async_init'] = 'done'
+
+
+@root.get('/')
+async def index(handler, async_init):
+    await tornado.gen.sleep(0)
+    handler.finish('init ' + async_init)
+
+
+@root.get('/user/<name>')
+@rw.gen.coroutine
+async def user_page(handler, name):
+    await tornado.gen.sleep(0.001)
+    # the scope must still be available after awaiting
+    assert rw.scope.get('handler') is handler
+    handler.finish('Hello ' + name)
+
+
+class AsyncHTTPServerTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=root)
+
+    def test_async_routes(self):
+        response = self.fetch('/')
+        assert response.body.decode('utf-8') == 'init done'
+        response = self.fetch('/user/joe')
+        assert response.body.decode('utf-8') == 'Hello joe'
+
+
+@needs_contextvars
+class ContextVarsAsyncHTTPServerTest(ContextVarsBackend, AsyncHTTPServerTest):
+    pass
+
+
+class AsyncEventTest(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_async_subscriber(self):
+        MY_EVENT = rw.event.Event('MY_EVENT')
+
+        @MY_EVENT.add
+        async def listener(x):
+            await tornado.gen.sleep(0)
+            return x * 2
+
+        result = yield MY_EVENT(21)
+        assert result == [42]
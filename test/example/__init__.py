@@ -52,12 +52,57 @@ def root_submit(handler):
     handler.finish('root POST')
 
 
+@root.put('/upload', stream=True)
+@gen.coroutine
+def upload(handler, body_stream):
+    # with stream=True the body is not buffered but read chunk by chunk
+    size = 0
+    while True:
+        chunk = yield body_stream.read()
+        if chunk is None:
+            break
+        size += len(chunk)
+    handler.finish('received {} bytes'.format(size))
+
+
+@root.put('/upload/limited', stream=True)
+def upload_limited(handler):
+    # respond without reading the body
+    handler.set_status(413)
+    handler.finish()
+
+
+@root.post('/upload/form')
+def upload_form(handler, form=None):
+    # with rw.http: multipart configured multipart bodies are parsed
+    # while they arrive, files are available through the injected form
+    if form is None:
+        handler.finish('not parsed incrementally')
+        return
+    files = ['{}={} {}'.format(name, part.filename, len(part.read()))
+             for name, parts in sorted(form.files.items()) for part in parts]
+    handler.finish(' '.join([handler.get_argument('title')] + files))
+
+
+@root.post('/json')
+def json_post(handler):
+    # the body is decoded on first access of json_body
+    handler.finish({'name': handler.json_body['name']})
+
+
 # TODO support: @root.get('/user', defaults={'name': 'me'})
 @root.get('/user/<name>')
 def user_page(handler, name):
     handler.finish('Hello ' + name)
 
 
+@root.get('/length')
+def length(handler):
+    body = b'explicit length'
+    handler.set_header('Content-Length', len(body))
+    handler.finish(body)
+
+
 @root.get('/otherplace')
 def other(handler):
     handler.finish('other')
@@ -83,6 +128,12 @@ def some_page():
     return root.render_template('index.html')
 
 
+@root.get('/foo/stream')
+def some_page_streamed():
+    # flush after every rendered part
+    return root.stream_template('index.html', chunk_size=1)
+
+
 class MainHandler(tornado.web.RequestHandler):
     def get(self):
         self.write("Tornado GET")
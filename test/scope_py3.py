@@ -1,3 +1,5 @@
+import asyncio
+
 import rw.scope
 
 
@@ -11,3 +13,45 @@ def test_python3_typehinted_injection():
 
     with scope():
         assert bar() == 42
+
+
+def test_contextvars_scopes():
+    """scopes of the contextvars backend must follow asyncio tasks"""
+    rw.scope.use_contextvars()
+    try:
+        scope_a = rw.scope.Scope()
+        scope_a['name'] = 'a'
+        scope_b = rw.scope.Scope()
+        scope_b['name'] = 'b'
+
+        @rw.scope.inject
+        def get_name(name):
+            return name
+
+        async def task(lock):
+            await lock.wait()
+            return get_name()
+
+        async def main():
+            lock_a = asyncio.Event()
+            lock_b = asyncio.Event()
+            with scope_a():
+                future_a = asyncio.ensure_future(task(lock_a))
+                with scope_b():
+                    assert rw.scope.get_current_scope() is scope_b
+                    future_b = asyncio.ensure_future(task(lock_b))
+                assert rw.scope.get_current_scope() is scope_a
+            assert rw.scope.get_current_scope() is None
+
+            lock_b.set()
+            assert await future_b == 'b'
+            lock_a.set()
+            assert await future_a == 'a'
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(main())
+        finally:
+            loop.close()
+    finally:
+        rw.scope.use_contextvars(False)
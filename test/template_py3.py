@@ -0,0 +1,139 @@
+"""Async template rendering"""
+import os
+
+import tornado.gen
+import tornado.locks
+import tornado.testing
+
+import rw.http
+import rw.httpbase
+import rw.scope
+import rw.template
+import rw.testing
+
+
+BASE = os.path.dirname(__file__)
+root = rw.http.Module('test.example')
+
+
+@root.init
+def init(template_env):
+    async def load(name):
+        await tornado.gen.sleep(0)
+        return name
+
+    template_env.globals['load'] = load
+
+
+@root.get('/')
+def index(handler):
+    event = tornado.locks.Event()
+
+    async def first():
+        # only finishes if `second` runs concurrently
+        await event.wait()
+        return 'first'
+
+    async def second():
+        event.set()
+        return 'second'
+
+    handler['first'] = first()
+    handler['second'] = second()
+    return root.render_template('async.html')
+
+
+@root.get('/nested')
+def nested(handler):
+    handler['first'] = 'first'
+    handler['second'] = [tornado.gen.maybe_future('second')]
+    # not returned, the request is still handled once rendered
+    root.render_template('async.html')
+
+
+@root.get('/broken')
+def broken(handler):
+    async def fail():
+        raise ValueError('broken')
+
+    handler['first'] = fail()
+    handler['second'] = 'second'
+    root.render_template('async.html')
+
+
+@root.get('/stream')
+def stream(handler):
+    handler['first'] = 'first'
+    handler['second'] = tornado.gen.maybe_future('second')
+    return root.stream_template('async.html', chunk_size=1)
+
+
+class AsyncTemplateTimingTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(
+            root=root, extra_configs=[BASE + '/configs/async_templates.yml',
+                                      BASE + '/configs/metrics.yml'])
+
+    def test_timing(self):
+        template_times = []
+
+        def record():
+            template_times.append(rw.scope.get('handler').timing.template)
+
+        rw.httpbase.POST_REQUEST.add(record)
+        try:
+            self.fetch('/')
+            self.fetch('/stream')
+        finally:
+            rw.httpbase.POST_REQUEST.remove(record)
+        assert len(template_times) == 2
+        assert all(template_time > 0 for template_time in template_times)
+
+
+class AsyncTemplateTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(
+            root=root, extra_configs=[BASE + '/configs/async_templates.yml'])
+
+    def test_render_async(self):
+        response = self.fetch('/')
+        assert response.body.decode('utf-8').strip() == 'first second third'
+
+    def test_render_not_returned(self):
+        response = self.fetch('/nested')
+        assert response.body.decode('utf-8').strip() == "first ['second'] third"
+        assert self.fetch('/broken').code == 500
+
+    def test_stream_async(self):
+        response = self.fetch('/stream')
+        assert response.body.decode('utf-8').strip() == 'first second third'
+
+
+class AsyncFragmentCacheTest(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_fragment_cache(self):
+        template_env = rw.template.create_template_env(['test.example'], enable_async=True)
+        template = template_env.from_string('{% cache "key" %}{{ load() }}{% endcache %}')
+        calls = []
+
+        async def load():
+            await tornado.gen.sleep(0)
+            calls.append(1)
+            return len(calls)
+
+        assert (yield template.render_async(load=load)) == '1'
+        assert (yield template.render_async(load=load)) == '1'
+
+
+class ResolveAwaitablesTest(tornado.testing.AsyncTestCase):
+    @tornado.testing.gen_test
+    def test_nested(self):
+        async def load(value):
+            await tornado.gen.sleep(0)
+            return value
+
+        plain = [1, 2]
+        context = {'nested': {'values': (load(1), [load(2)])}, 'plain': plain, 'direct': load(3)}
+        result = yield rw.template.resolve_awaitables(context)
+        assert result == {'nested': {'values': (1, [2])}, 'plain': [1, 2], 'direct': 3}
+        assert result['plain'] is plain
@@ -2,7 +2,34 @@ import os
 import sys
 import tempfile
 import imp
+import time
 import shutil
 
+import tornado.testing
+
 import rw.testing
 import rw.cli
+
+from . import example
+
+
+class StopServerTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root)
+
+    @tornado.testing.gen_test
+    def test_stop_idle(self):
+        response = yield self.http_client.fetch(self.get_url('/lazy'))
+        assert response.code == 200
+        assert self._app.active_requests == 0
+        start = time.time()
+        yield rw.cli.stop_server(self.http_server, self._app)
+        assert time.time() - start < 1
+
+    @tornado.testing.gen_test
+    def test_stop_waits_for_requests(self):
+        self._app.active_requests = 1
+        start = time.time()
+        yield rw.cli.stop_server(self.http_server, self._app, timeout=0.2)
+        assert time.time() - start >= 0.2
+        self._app.active_requests = 0
@@ -0,0 +1,139 @@
+import os
+import imp
+import zlib
+
+import tornado.httputil
+
+import rw.compress
+import rw.httpbase
+import rw.scope
+import rw.testing
+
+from . import example
+
+
+BASE = os.path.dirname(__file__)
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def test_gzip_bytes():
+    assert gunzip(rw.compress.gzip_bytes(b'Hello World' * 10)) == b'Hello World' * 10
+
+
+def test_is_compressible():
+    assert rw.compress.is_compressible('text/html; charset=UTF-8')
+    assert rw.compress.is_compressible('application/json')
+    assert not rw.compress.is_compressible('image/png')
+    assert not rw.compress.is_compressible(None)
+
+
+def test_accepts_gzip():
+    def accepts(value):
+        headers = tornado.httputil.HTTPHeaders({'Accept-Encoding': value})
+        return rw.compress.accepts_gzip(tornado.httputil.HTTPServerRequest(
+            'GET', '/', headers=headers))
+
+    assert accepts('gzip')
+    assert accepts('deflate, gzip;q=0.5')
+    assert accepts('GZIP')
+    assert accepts('*')
+    assert not accepts('')
+    assert not accepts('identity')
+    assert not accepts('gzip;q=0')
+    assert not accepts('identity, gzip;q=0')
+    assert not accepts('gzip; q=0.0, *')
+    assert not accepts('*;q=0')
+
+
+def test_add_vary():
+    headers = tornado.httputil.HTTPHeaders()
+    rw.compress.add_vary(headers)
+    assert headers['Vary'] == 'Accept-Encoding'
+    rw.compress.add_vary(headers)
+    assert headers['Vary'] == 'Accept-Encoding'
+
+    headers = tornado.httputil.HTTPHeaders({'Vary': 'Cookie'})
+    rw.compress.add_vary(headers)
+    assert headers['Vary'] == 'Cookie, Accept-Encoding'
+
+
+def test_from_config():
+    assert rw.compress.from_config(None) is None
+    assert rw.compress.from_config(True).level == rw.compress.DEFAULT_LEVEL
+    assert rw.compress.from_config({'level': 1}).level == 1
+
+
+class CompressHTTPTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root,
+                                       extra_configs=[BASE + '/configs/gzip.yml'])
+
+    def fetch_gzip(self, path, accept='gzip'):
+        return self.fetch(path, headers={'Accept-Encoding': accept},
+                          decompress_response=False)
+
+    def test_dynamic(self):
+        response = self.fetch_gzip('/')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert gunzip(response.body) == b'Hello World'
+
+        response = self.fetch_gzip('/', accept='identity')
+        assert 'Content-Encoding' not in response.headers
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert response.body == b'Hello World'
+
+        response = self.fetch_gzip('/', accept='identity, gzip;q=0')
+        assert 'Content-Encoding' not in response.headers
+        assert response.body == b'Hello World'
+
+        # smaller than min_size
+        response = self.fetch_gzip('/user/me')
+        assert 'Content-Encoding' not in response.headers
+
+    def test_dynamic_thread(self):
+        self._app.compression.thread_size = 0
+        response = self.fetch_gzip('/')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gunzip(response.body) == b'Hello World'
+
+    def test_finished_before_post_request(self):
+        finished = []
+
+        def record():
+            finished.append(rw.scope.get('handler')._finished)
+
+        self._app.compression.thread_size = 0
+        rw.httpbase.POST_REQUEST.add(record)
+        try:
+            self.fetch_gzip('/')
+        finally:
+            rw.httpbase.POST_REQUEST.remove(record)
+        assert finished == [True]
+
+    def test_explicit_content_length(self):
+        for thread_size in (1024, 0):
+            self._app.compression.thread_size = thread_size
+            response = self.fetch_gzip('/length')
+            assert gunzip(response.body) == b'explicit length'
+            assert int(response.headers['Content-Length']) == len(response.body)
+
+    def test_static(self):
+        url = self._app.scope['static']('/test.example/hello_world.txt')
+        response = self.fetch_gzip(url)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert gunzip(response.body) == b'Hello Static World'
+        etag = response.headers['Etag']
+
+        response = self.fetch_gzip(url, accept='identity')
+        assert 'Content-Encoding' not in response.headers
+        assert response.body == b'Hello Static World'
+        assert response.headers['Etag'] != etag
+
+        response = self.fetch_gzip(url, accept='gzip;q=0')
+        assert 'Content-Encoding' not in response.headers
+        assert response.body == b'Hello Static World'
@@ -1,5 +1,7 @@
 from __future__ import absolute_import, division, print_function, with_statement
 
+import sys
+
 import pytest
 import rw.event
 
@@ -80,3 +82,7 @@ class MyTestCase(tornado.testing.AsyncTestCase):
 
         with pytest.raises(ZeroDivisionError):
             yield MY_EVENT()
+
+
+if sys.version_info >= (3, 5):
+    from .async_py3 import AsyncEventTest
@@ -1,9 +1,13 @@
 import imp
+import sys
 
 import pkg_resources
 import rw.testing
+import rw.scope
+import rw.httpbase
 
 from . import example
+from .test_scope import ContextVarsBackend, needs_contextvars
 
 
 class HTTPServerTest(rw.testing.AsyncHTTPTestCase):
@@ -44,12 +48,69 @@ class HTTPServerTest(rw.testing.AsyncHTTPTestCase):
         self.check_path(hello_world2, hello_world_content)
         hello_world_response = self.fetch(hello_world)
 
+    def test_stream_template(self):
+        response = self.fetch('/foo/stream')
+        assert response.code == 200
+        assert response.headers['Transfer-Encoding'] == 'chunked'
+        assert response.body == self.fetch('/foo').body
+
     def test_different_methods(self):
         self.check_path('/', u'root POST', method='POST', request_body='')
         self.check_path('/put', u'put', method='PUT', request_body='')
         self.check_path('/delete', u'delete', method='DELETE')
         self.check_path('/options', u'options', method='OPTIONS')
 
+    def test_stream_request_body(self):
+        body = b'x' * (1024 * 1024)
+        self.check_path('/upload', u'received 1048576 bytes', method='PUT',
+                        request_body=body)
+        self.check_path('/upload', u'received 0 bytes', method='PUT', request_body=b'')
+
+    def test_stream_request_body_unread(self):
+        streams = []
+
+        class BodyStream(rw.httpbase.BodyStream):
+            def __init__(self):
+                super(BodyStream, self).__init__()
+                streams.append(self)
+
+        body = b'x' * (4 * 1024 * 1024)
+        original = rw.httpbase.BodyStream
+        rw.httpbase.BodyStream = BodyStream
+        try:
+            response = self.fetch('/upload/limited', method='PUT', body=body)
+        finally:
+            rw.httpbase.BodyStream = original
+        assert response.code == 413
+        # nobody waits for room in the stream anymore
+        stream, = streams
+        assert stream.discarding
+        assert stream.put(b'more') is None
+        # the request got handled completely
+        assert self._app.active_requests == 0
+        self.check_path('/', u'Hello World')
+
+    def test_methods_without_routes(self):
+        self.check_path('/', code=404, method='HEAD')
+        self.check_path('/', code=404, method='PATCH', request_body='')
+
+    def test_pre_request_rewrites_path(self):
+        def rewrite():
+            request = rw.scope.get('handler').request
+            if request.path == '/rewrite':
+                request.path = '/otherplace'
+
+        rw.httpbase.PRE_REQUEST.add(rewrite)
+        try:
+            self.check_path('/rewrite', u'other')
+        finally:
+            rw.httpbase.PRE_REQUEST.remove(rewrite)
+
+    def test_json_body(self):
+        self.check_path('/json', u'{"name": "joe"}', method='POST',
+                        request_body='{"name": "joe"}')
+        self.check_path('/json', code=400, method='POST', request_body='{')
+
     def test_mount_tornado_handler(self):
         self.check_path('/tornado', u'Tornado GET')
 
@@ -64,5 +125,16 @@ class HTTPServerTest(rw.testing.AsyncHTTPTestCase):
         # from static2 folder (higher in config file)
         self.check_path(base_url + 'overwrite.txt', u'Overwrite')
 
+        self.check_path(base_url + 'nothing.txt', code=404)
+
     def test_url_for_inside_submodule(self):
         self.check_path('/sub', '/sub\n/sub')
+
+
+@needs_contextvars
+class ContextVarsHTTPServerTest(ContextVarsBackend, HTTPServerTest):
+    pass
+
+
+if sys.version_info >= (3, 5):
+    from .async_py3 import AsyncHTTPServerTest, ContextVarsAsyncHTTPServerTest
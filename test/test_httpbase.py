@@ -1,7 +1,11 @@
+import pytest
+import tornado.iostream
+import tornado.httputil
 import tornado.web
 from tornado.testing import AsyncHTTPTestCase, AsyncTestCase, ExpectLog, gen_test
 
 import rw.httpbase
+import rw.server
 
 
 class HelloWorldHandler(rw.httpbase.RequestHandler):
@@ -33,3 +37,71 @@ class HTTPServerEventTest(AsyncHTTPTestCase):
     @classmethod
     def teardown_class(cls):
         rw.httpbase.PRE_REQUEST.clear()
+
+
+class BodyStreamTest(AsyncTestCase):
+    @gen_test
+    def test_read(self):
+        stream = rw.httpbase.BodyStream(max_chunks=1)
+        yield stream.put(b'a')
+        second = stream.put(b'b')
+        assert not second.done()
+        assert (yield stream.read()) == b'a'
+        yield second
+        stream.finish()
+        assert (yield stream.read()) == b'b'
+        assert (yield stream.read()) is None
+        assert (yield stream.read()) is None
+
+    @gen_test
+    def test_closed(self):
+        stream = rw.httpbase.BodyStream()
+        yield stream.put(b'a')
+        stream.close()
+        assert (yield stream.read()) == b'a'
+        with pytest.raises(tornado.iostream.StreamClosedError):
+            yield stream.read()
+
+    @gen_test
+    def test_close_full(self):
+        stream = rw.httpbase.BodyStream(max_chunks=1)
+        stream.put(b'a')
+        waiting = stream.put(b'b')
+        stream.close()
+        # closing must not block and releases the waiting producer
+        assert waiting.done()
+        assert (yield stream.read()) == b'a'
+
+    @gen_test
+    def test_discard(self):
+        stream = rw.httpbase.BodyStream(max_chunks=1)
+        stream.put(b'a')
+        waiting = stream.put(b'b')
+        stream.discard()
+        assert waiting.done()
+        assert stream.put(b'c') is None
+        stream.finish()
+
+
+def test_lazy_body_parsing():
+    headers = tornado.httputil.HTTPHeaders({
+        'Content-Type': 'application/x-www-form-urlencoded'})
+    request = rw.httpbase.HTTPServerRequest('POST', '/?a=1', headers=headers,
+                                            body=b'a=2&b=3')
+    request._parse_body()
+    assert request._body_pending
+    assert request.arguments == {'a': [b'1', b'2'], 'b': [b'3']}
+    assert request.body_arguments == {'a': [b'2'], 'b': [b'3']}
+    assert request.query_arguments == {'a': [b'1']}
+    assert request.files == {}
+
+
+class HandlerOnlyStartupTest(AsyncTestCase):
+    @gen_test
+    def test_no_phases(self):
+        # without root module there is nothing to configure, the
+        # startup phases must not fail because of such applications
+        app = rw.httpbase.Application(handler=HelloWorldHandler)
+        assert app.configure not in rw.server.PHASE_CONFIGURATION
+        assert app.post_start not in rw.server.PHASE_POST_START
+        yield rw.server.start()
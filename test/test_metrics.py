@@ -0,0 +1,92 @@
+import os
+import imp
+import time
+
+import rw.httpbase
+import rw.metrics
+import rw.scope
+import rw.testing
+
+from . import example
+
+
+BASE = os.path.dirname(__file__)
+
+
+def test_render():
+    metrics = rw.metrics.Metrics(buckets=[0.1, 1])
+    metrics.observe('GET', '/user/<name>', 200, 0.05)
+    metrics.observe('GET', '/user/<name>', 200, 0.5)
+    metrics.observe('GET', '/user/<name>', 404, 2)
+
+    lines = metrics.render().splitlines()
+    assert 'rw_requests_total{method="GET",route="/user/<name>",status="200"} 2' in lines
+    assert 'rw_requests_total{method="GET",route="/user/<name>",status="404"} 1' in lines
+    labels = 'method="GET",route="/user/<name>"'
+    assert 'rw_request_duration_seconds_bucket{' + labels + ',le="0.1"} 1' in lines
+    assert 'rw_request_duration_seconds_bucket{' + labels + ',le="1.0"} 2' in lines
+    assert 'rw_request_duration_seconds_bucket{' + labels + ',le="+Inf"} 3' in lines
+    assert 'rw_request_duration_seconds_count{' + labels + '} 3' in lines
+
+
+def test_escape_labels():
+    metrics = rw.metrics.Metrics()
+    metrics.observe('GET', '/"quoted"\\', 200, 0.01)
+    assert 'route="/\\"quoted\\"\\\\"' in metrics.render()
+
+
+class MetricsHTTPTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root,
+                                       extra_configs=[BASE + '/configs/metrics.yml'])
+
+    def test_metrics(self):
+        response = self.fetch('/user/joe')
+        assert response.code == 200
+        assert 'routing;dur=' in response.headers['Server-Timing']
+        self.fetch('/user/bob')
+        self.fetch('/foo')
+        self.fetch('/nowhere')
+
+        body = self.fetch('/metrics').body.decode('utf-8')
+        assert 'rw_requests_total{method="GET",route="/user/<name>",status="200"} 2' in body
+        assert 'rw_requests_total{method="GET",route="/foo",status="200"} 1' in body
+        assert 'rw_requests_total{method="GET",route="<none>",status="404"} 1' in body
+
+    def test_routing_timing(self):
+        routing_times = []
+
+        def slow_pre_request():
+            time.sleep(0.05)
+
+        def record():
+            routing_times.append(rw.scope.get('handler').timing.routing)
+
+        rw.httpbase.PRE_REQUEST.add(slow_pre_request)
+        rw.httpbase.POST_REQUEST.add(record)
+        try:
+            self.fetch('/user/joe')
+        finally:
+            rw.httpbase.PRE_REQUEST.remove(slow_pre_request)
+            rw.httpbase.POST_REQUEST.remove(record)
+        # the time spent in PRE_REQUEST is not routing
+        assert routing_times[0] < 0.05
+
+    def test_template_timing(self):
+        template_times = []
+
+        def record():
+            template_times.append(rw.scope.get('handler').timing.template)
+
+        rw.httpbase.POST_REQUEST.add(record)
+        try:
+            self.fetch('/foo')
+            self.fetch('/foo/stream')
+        finally:
+            rw.httpbase.POST_REQUEST.remove(record)
+
+        # rendering and streaming record the time spent in the template
+        assert len(template_times) == 2
+        assert all(template_time > 0 for template_time in template_times)
+        body = self.fetch('/metrics').body.decode('utf-8')
+        assert 'rw_requests_total{method="GET",route="/foo/stream",status="200"} 1' in body
@@ -0,0 +1,119 @@
+import os
+import imp
+
+import pytest
+import tornado.httputil
+
+import rw.multipart
+import rw.testing
+
+from . import example
+
+
+BASE = os.path.dirname(__file__)
+BOUNDARY = b'1234'
+BODY = (b'preamble\r\n'
+        b'--1234\r\n'
+        b'Content-Disposition: form-data; name="title"\r\n'
+        b'\r\n'
+        b'Hello\r\n'
+        b'--1234\r\n'
+        b'Content-Disposition: form-data; name="upload"; filename="a.txt"\r\n'
+        b'Content-Type: text/plain\r\n'
+        b'\r\n'
+        b'--123 is no delimiter\r\n'
+        b'--1234--\r\n'
+        b'epilogue')
+
+
+def parse(body, chunk_size, spool_size=1024, max_field_size=1024):
+    parser = rw.multipart.MultipartParser(BOUNDARY, spool_size,
+                                          max_field_size=max_field_size)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+    return parser.finish()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1024])
+def test_parse(chunk_size):
+    form = parse(BODY, chunk_size)
+    assert form.fields == {'title': [b'Hello']}
+    part, = form.files['upload']
+    assert part.filename == 'a.txt'
+    assert part.content_type == 'text/plain'
+    assert part.read() == b'--123 is no delimiter'
+    form.close()
+
+
+def test_spool():
+    form = parse(BODY, 1024, spool_size=1)
+    part, = form.files['upload']
+    assert part.file._rolled
+    assert part.read() == b'--123 is no delimiter'
+
+    form = parse(BODY, 1024)
+    assert not form.files['upload'][0].file._rolled
+
+
+@pytest.mark.parametrize('chunk_size', [1, 1024])
+def test_field_too_large(chunk_size):
+    assert parse(BODY, chunk_size, max_field_size=5).fields == {'title': [b'Hello']}
+    with pytest.raises(rw.multipart.FieldTooLarge) as e:
+        parse(BODY, chunk_size, max_field_size=4)
+    assert e.value.status_code == 413
+    # files are not limited
+    assert parse(BODY, chunk_size, max_field_size=5).files['upload'][0].read()
+
+
+def test_invalid():
+    with pytest.raises(rw.multipart.MultipartError):
+        parse(BODY[:-20], 1024)
+    with pytest.raises(rw.multipart.MultipartError):
+        parse(BODY.replace(b'form-data; ', b''), 1024)
+
+
+@pytest.mark.parametrize('headers', [
+    b'Content-Disposition form-data',
+    b'Content-Disposition: form-data; name="\xff"',
+])
+def test_invalid_headers(headers):
+    body = b'--1234\r\n' + headers + b'\r\n\r\nx\r\n--1234--'
+    with pytest.raises(rw.multipart.MultipartError):
+        parse(body, 1024)
+
+
+def test_parser_from_headers():
+    multipart = rw.multipart.from_config(True)
+    headers = tornado.httputil.HTTPHeaders({
+        'Content-Type': 'multipart/form-data; boundary="1234"'})
+    assert multipart.parser(headers).delimiter == b'\r\n--1234'
+    headers = tornado.httputil.HTTPHeaders({
+        'Content-Type': 'application/x-www-form-urlencoded'})
+    assert multipart.parser(headers) is None
+    assert rw.multipart.from_config(None) is None
+
+
+class MultipartHTTPTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root,
+                                       extra_configs=[BASE + '/configs/multipart.yml'])
+
+    def post(self, body):
+        headers = {'Content-Type': 'multipart/form-data; boundary=1234'}
+        return self.fetch('/upload/form', method='POST', headers=headers, body=body)
+
+    def test_upload(self):
+        response = self.post(BODY)
+        assert response.code == 200
+        assert response.body == b'Hello upload=a.txt 21'
+
+    def test_invalid(self):
+        response = self.post(BODY[:-20])
+        assert response.code == 400
+
+        response = self.post(b'--1234\r\nContent-Disposition form-data\r\n\r\nx\r\n--1234--')
+        assert response.code == 400
+
+    def test_field_too_large(self):
+        response = self.post(BODY.replace(b'Hello', b'Hello' * 10))
+        assert response.code == 413
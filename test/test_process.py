@@ -0,0 +1,113 @@
+import os
+import time
+import signal
+
+import pytest
+
+import rw.process
+
+
+def test_parse_workers():
+    assert rw.process.parse_workers('4') == 4
+    assert rw.process.parse_workers('auto') >= 1
+
+    with pytest.raises(ValueError):
+        rw.process.parse_workers('0')
+
+    with pytest.raises(ValueError):
+        rw.process.parse_workers('many')
+
+
+class FakeProcesses(object):
+    """replaces forking, waiting and signals for `rw.process.fork_workers`
+
+    :param list pids: results of `os.fork`, 0 being the child
+    :param list exits: results of `os.wait` or functions returning them
+    """
+
+    def __init__(self, monkeypatch, pids, exits):
+        self.pids = list(pids)
+        self.exits = list(exits)
+        self.signals = {}
+        self.killed = []
+        self.sleeps = []
+        self.time = 0
+        monkeypatch.setattr(time, 'time', lambda: self.time)
+        monkeypatch.setattr(time, 'sleep', self.sleep)
+        monkeypatch.setattr(os, 'fork', lambda: self.pids.pop(0))
+        monkeypatch.setattr(os, 'wait', self.wait)
+        monkeypatch.setattr(os, 'kill', lambda pid, signum: self.killed.append(pid))
+        monkeypatch.setattr(signal, 'signal', self.signals.__setitem__)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.time += seconds
+
+    def wait(self):
+        result = self.exits.pop(0)
+        return result() if callable(result) else result
+
+
+def test_fork_workers_child(monkeypatch):
+    processes = FakeProcesses(monkeypatch, [101, 0], [])
+    assert rw.process.fork_workers(2) == 1
+    assert processes.signals[signal.SIGTERM] == signal.SIG_DFL
+
+
+def test_fork_workers_restart(monkeypatch):
+    # worker 0 gets killed, the restarted process is worker 0 again
+    processes = FakeProcesses(monkeypatch, [101, 102, 0], [(101, signal.SIGKILL)])
+    assert rw.process.fork_workers(2) == 0
+    assert not processes.pids
+
+
+def test_fork_workers_exit(monkeypatch):
+    # workers exiting normally are not restarted
+    FakeProcesses(monkeypatch, [101, 102], [(102, 0), (101, 0)])
+    with pytest.raises(SystemExit):
+        rw.process.fork_workers(2)
+
+
+def test_fork_workers_too_many_restarts(monkeypatch):
+    FakeProcesses(monkeypatch, [101], [(101, 1 << 8)])
+    with pytest.raises(RuntimeError):
+        rw.process.fork_workers(1, max_restarts=0)
+
+
+def test_fork_workers_restart_backoff(monkeypatch):
+    # worker 0 keeps crashing, restarts are delayed more and more
+    crashes = [(101, 1 << 8), (102, 1 << 8), (103, 1 << 8)]
+    processes = FakeProcesses(monkeypatch, [101, 102, 103, 0], crashes)
+    assert rw.process.fork_workers(1) == 0
+    delay = rw.process.RESTART_DELAY
+    assert processes.sleeps == [delay, delay * 2, delay * 4]
+
+
+def test_fork_workers_restart_window(monkeypatch):
+    processes = FakeProcesses(monkeypatch, [101, 102, 0], [])
+
+    def crash_later(pid):
+        def wait():
+            # longer than the restart window after the last restart
+            processes.time += 100
+            return (pid, 1 << 8)
+        return wait
+
+    processes.exits = [crash_later(101), crash_later(102)]
+    assert rw.process.fork_workers(1, max_restarts=1, restart_window=60) == 0
+    delay = rw.process.RESTART_DELAY
+    assert processes.sleeps == [delay, delay]
+
+
+def test_fork_workers_shutdown(monkeypatch):
+    processes = FakeProcesses(monkeypatch, [101, 102], [])
+
+    def wait():
+        # SIGTERM arrives while waiting for the workers
+        processes.signals[signal.SIGTERM](signal.SIGTERM, None)
+        return (101, signal.SIGTERM)
+
+    processes.exits = [wait, (102, signal.SIGTERM)]
+    with pytest.raises(SystemExit):
+        rw.process.fork_workers(2)
+    assert sorted(processes.killed) == [101, 102]
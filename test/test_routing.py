@@ -131,6 +131,80 @@ def test_submodules():
         assert func.__name__ == 'fun'
 
 
+def test_route_tree_priority():
+    """the route tree must pick the same route as a linear scan
+    over the sorted routes does"""
+    paths = ['/', '/name', '/name/<name>/photo', '/name/<else>', '/<something>',
+             '/na<something>', '/name<something>', '/<something:int>',
+             '/user/<uid:int>', '/user/<name>', '/user/me', '/files/<p:path>',
+             '/files/static', '/<a>/<b>', '/<a:int>/<b>']
+    rt = rw.routing.RoutingTable('root')
+    for i, path in enumerate(paths):
+        rt.add_route('get', path, None, generate_route_func('route_{}'.format(i)))
+
+    scope = rw.scope.Scope()
+    rw.routing.init(scope)
+    with scope():
+        rt.setup()
+        for test_path in ['', '/', '/name', '/nam', '/namefoo', '/name/joe/photo',
+                          '/name/joe', '/12', '/user/12', '/user/me', '/user/you',
+                          '/files/a/b', '/files/static', '/files/', '/a/b', '/1/b',
+                          '/x/y/z']:
+            expected = None, None, None, None
+            for rule, name_prefix, module, fn, _ in rt['get']:
+                args = rule.match(test_path)
+                if args is not None:
+                    expected = name_prefix, module, fn, args
+                    break
+            assert rt.find_route('get', test_path) == expected, test_path
+
+
+def test_setup_unknown_converter():
+    rt = rw.routing.RoutingTable('root')
+    rt.add_route('get', '/<name:unknown>', None, generate_route_func('index'))
+
+    # unknown converters must fail during setup, not during the first request
+    with pytest.raises(AttributeError):
+        rt.setup(converters={'str': rw.routing.converter_default})
+
+
+def test_compiled_match():
+    # compiled routes match without any scope
+    route = generate_rule('/user/<uid:int>/<name>')
+    route.compile({'str': rw.routing.converter_default,
+                   'int': rw.routing.converter_int})
+    assert route.match('/user/12/joe') == {'uid': 12, 'name': 'joe'}
+    assert route.match('/user/joe/joe') is None
+
+
+def test_call_plan():
+    @rw.scope.inject
+    def user_page(handler, name, page=1):
+        return handler, name, page
+
+    plan = rw.routing.CallPlan(generate_rule('/user/<name>/<tab>'), user_page)
+    assert plan.url_variables == ('name',)
+    assert plan.inject == ('handler', 'page')
+    assert not plan.accepts_kwargs
+
+    scope = rw.scope.Scope()
+    scope['handler'] = 'handler'
+    with scope():
+        assert plan({'name': 'joe', 'tab': 'posts'}) == ('handler', 'joe', 1)
+
+
+def test_call_plan_missing_argument(capsys):
+    @rw.scope.inject
+    def user_page(handler, name):
+        pass
+
+    plan = rw.routing.CallPlan(generate_rule('/user/<name>'), user_page)
+    with rw.scope.Scope()():
+        with pytest.raises(TypeError):
+            plan({'name': 'joe'})
+    assert 'Error injecting into {}.user_page'.format(__name__) in capsys.readouterr().err
+
+
 class MyTestCase(tornado.testing.AsyncTestCase):
     def test_rule_match(self):
         # match must be used inside scope with rw.routing:plugin activated
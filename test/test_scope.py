@@ -7,6 +7,7 @@ from tornado import concurrent
 import tornado.gen
 import tornado.testing
 
+import rw.gen
 import rw.scope
 
 
@@ -146,6 +147,100 @@ def test_sub_scope():
         checks_inside_scope1()
 
 
+def test_frozen_scope():
+    scope = rw.scope.Scope()
+    scope['value'] = 1
+    scope.subscope('sub')['x'] = 1
+    scope.provider('lazy', lambda: 'provided')
+    scope.freeze()
+    request_scope = rw.scope.Scope()
+
+    with scope():
+        with request_scope():
+            assert rw.scope.get('value') == 1
+            assert rw.scope.get('sub')['x'] == 1
+            assert rw.scope.get('lazy') == 'provided'
+
+            # writes after freezing must be visible
+            scope['value'] = 2
+            assert rw.scope.get('value') == 2
+            scope.setdefault('new', 3)
+            assert rw.scope.get('new') == 3
+            del scope['new']
+            assert rw.scope.get('new', None) is None
+            scope.update(value=4)
+            assert rw.scope.get('value') == 4
+
+            # inner scopes still shadow frozen ones
+            request_scope['value'] = 5
+            assert rw.scope.get('value') == 5
+
+
+def test_frozen_scope_chain():
+    outer = rw.scope.Scope()
+    outer['value'] = 1
+    outer.provider('lazy', lambda: 'provided')
+    outer.freeze()
+    inner = rw.scope.Scope()
+    inner['inner'] = 2
+    inner.freeze()
+
+    class CountingIndex(dict):
+        def get(self, *args):
+            lookups.append(args[0])
+            return dict.get(self, *args)
+
+    with outer():
+        with inner():
+            assert rw.scope.get('value') == 1
+            lookups = []
+            outer._index = CountingIndex(outer._index)
+            inner._index = CountingIndex(inner._index)
+            # the chain index answers hits and misses of both scopes
+            assert rw.scope.get('value') == 1
+            assert rw.scope.get('inner') == 2
+            assert rw.scope.get('missing', None) is None
+            assert lookups == []
+
+            assert rw.scope.get('lazy') == 'provided'
+            assert rw.scope.get('lazy') == 'provided'
+            inner['value'] = 3
+            assert rw.scope.get('value') == 3
+
+
+def test_request_scope():
+    app_scope = rw.scope.Scope()
+    app_scope['value'] = 1
+    app_scope.subscope('sub')['x'] = 1
+    request_scope = rw.scope.RequestScope()
+    other_request_scope = rw.scope.RequestScope()
+
+    with app_scope():
+        with request_scope():
+            assert rw.scope.get('value') == 1
+            assert rw.scope.get('sub')['x'] == 1
+
+            # side tables are created on first use
+            request_scope.provider('user', lambda: 'joe')
+            assert rw.scope.get('user') == 'joe'
+            request_scope.subscope('sub')['x'] = 2
+            assert rw.scope.get('sub')['x'] == 2
+
+        with other_request_scope():
+            # nothing leaked into the shared empty tables
+            assert rw.scope.get('user', None) is None
+            assert rw.scope.get('sub')['x'] == 1
+
+
+def test_scope_attributes():
+    # plugins may store their own attributes on scopes
+    scope = rw.scope.Scope()
+    scope.custom = 1
+    sub_scope = scope.subscope('sub')
+    sub_scope.custom = 2
+    assert (scope.custom, sub_scope.custom) == (1, 2)
+
+
 def test_fail():
     @rw.scope.inject
     def foo(something_to_inject):
@@ -191,6 +286,7 @@ class ConcurrencyTest(tornado.testing.AsyncTestCase):
 
     Three tests with different resolution order
     """
+    coroutine = staticmethod(tornado.gen.coroutine)
 
     def setup(self):
         """Setup two scopes and two "locks"."""
@@ -205,12 +301,12 @@ class ConcurrencyTest(tornado.testing.AsyncTestCase):
         def get_name(name):
             return name
 
-        @tornado.gen.coroutine
+        @self.coroutine
         def thread_a():
             yield self.lock_a
             raise tornado.gen.Return(get_name())
 
-        @tornado.gen.coroutine
+        @self.coroutine
         def thread_b():
             yield self.lock_b
             raise tornado.gen.Return(get_name())
@@ -268,7 +364,58 @@ class ConcurrencyTest(tornado.testing.AsyncTestCase):
         assert (yield future_b) == 'b'
 
 
+class ContextVarsBackend(object):
+    """mixin running a `tornado.testing.AsyncTestCase` with the
+    contextvars backend of `rw.scope`"""
+
+    def setUp(self):
+        rw.scope.use_contextvars()
+        super(ContextVarsBackend, self).setUp()
+
+    def tearDown(self):
+        super(ContextVarsBackend, self).tearDown()
+        rw.scope.use_contextvars(False)
+
+
+needs_contextvars = pytest.mark.skipif(sys.version_info < (3, 7),
+                                       reason='contextvars require python 3.7')
+
+
+@needs_contextvars
+class ContextVarsScopeLeakingTest(ContextVarsBackend, ScopeLeakingTest):
+    pass
+
+
+@needs_contextvars
+class ContextVarsConcurrencyTestWithoutWithStatement(
+        ContextVarsBackend, ConcurrencyTestWithoutWithStatement):
+    pass
+
+
+@needs_contextvars
+class ContextVarsConcurrencyTest(ContextVarsBackend, ConcurrencyTest):
+    # plain tornado coroutines lose the context
+    coroutine = staticmethod(rw.gen.coroutine)
+
+    def test_wrapper_picked_when_decorating(self):
+        def fn():
+            yield
+        assert rw.gen._in_context(fn) is not fn
+        rw.scope.use_contextvars(False)
+        try:
+            # no overhead without contextvars
+            assert rw.gen._in_context(fn) is fn
+        finally:
+            rw.scope.use_contextvars()
+
+
 if sys.version_info >= (3, 0):
     def test_scope_with_hint():
         from test.scope_py3 import test_python3_typehinted_injection
         test_python3_typehinted_injection()
+
+
+if sys.version_info >= (3, 7):
+    def test_contextvars_scopes():
+        from test.scope_py3 import test_contextvars_scopes
+        test_contextvars_scopes()
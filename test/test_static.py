@@ -1,4 +1,17 @@
+import os
+import gzip
+import shutil
+import tempfile
+
+import imp
+
 import rw.static
+import rw.testing
+
+from . import example
+
+
+BASE = os.path.dirname(__file__)
 
 
 def test_hash_file_adblock():
@@ -16,3 +29,185 @@ def test_hash_file_adblock():
         h = rw.static.file_hash(str(i).encode('utf-8'))
         h = h[:2].lower()
         assert h != 'ad', i
+
+
+def make_static(root, debug):
+    with open(os.path.join(root, 'a.txt'), 'wb') as fileobj:
+        fileobj.write(b'a')
+    os.mkdir(os.path.join(root, 'sub'))
+    with open(os.path.join(root, 'sub', 'b.txt'), 'wb') as fileobj:
+        fileobj.write(b'b')
+
+    static = rw.static.Static(debug=debug)
+    static.handlers.append(('static', rw.static.StaticHandler, [root]))
+    static.setup()
+    static.build_manifest()
+    return static
+
+
+def test_manifest():
+    root = tempfile.mkdtemp()
+    try:
+        static = make_static(root, debug=False)
+        assert sorted(static.manifest) == ['/static/a.txt', '/static/sub/b.txt']
+        h = rw.static.file_hash(b'b')[:6]
+        assert static('/sub/b.txt') == '/static/{}/sub/b.txt'.format(h)
+
+        # without debug changes are not picked up
+        with open(os.path.join(root, 'a.txt'), 'wb') as fileobj:
+            fileobj.write(b'changed')
+        h = rw.static.file_hash(b'a')[:6]
+        assert static('/a.txt') == '/static/{}/a.txt'.format(h)
+    finally:
+        shutil.rmtree(root)
+
+
+def test_sources_with_parent_reference():
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, 'sub'))
+        with open(os.path.join(root, 'a.txt'), 'wb') as fileobj:
+            fileobj.write(b'a')
+        cfg = {'static': [{'path': os.path.join(root, 'sub', '..')}]}
+        (base_uri, roots), = rw.static.get_sources(cfg)
+        assert rw.static.find_file(roots, 'a.txt') == os.path.join(root, 'a.txt')
+        assert rw.static.find_file(roots, '../a.txt') is None
+    finally:
+        shutil.rmtree(root)
+
+
+def test_manifest_debug():
+    root = tempfile.mkdtemp()
+    try:
+        static = make_static(root, debug=True)
+        with open(os.path.join(root, 'a.txt'), 'wb') as fileobj:
+            fileobj.write(b'changed')
+        h = rw.static.file_hash(b'changed')[:6]
+        assert static('/a.txt') == '/static/{}/a.txt'.format(h)
+    finally:
+        shutil.rmtree(root)
+
+
+def test_build():
+    root = tempfile.mkdtemp()
+    out = tempfile.mkdtemp()
+    try:
+        static = make_static(root, debug=False)
+        with open(os.path.join(root, 'big.txt'), 'wb') as fileobj:
+            fileobj.write(b'big' * 1000)
+        static.build_manifest()
+        rw.static.build(static, out)
+
+        url = static('/big.txt')
+        with gzip.open(os.path.join(out, url.lstrip('/') + '.gz')) as fileobj:
+            assert fileobj.read() == b'big' * 1000
+        # not worth compressing
+        assert not os.path.exists(os.path.join(out, static('/a.txt').lstrip('/') + '.gz'))
+
+        built = rw.static.Static(debug=False)
+        built.load_manifest(out)
+        assert built.manifest.keys() == static.manifest.keys()
+        assert built('/sub/b.txt') == static('/sub/b.txt')
+        with open(built.manifest['/static/sub/b.txt'][0], 'rb') as fileobj:
+            assert fileobj.read() == b'b'
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(out)
+
+
+def test_file_cache():
+    root = tempfile.mkdtemp()
+    try:
+        paths = []
+        for name in 'abc':
+            paths.append(os.path.join(root, name))
+            with open(paths[-1], 'wb') as fileobj:
+                fileobj.write(name.encode('ascii') * 10)
+
+        cache = rw.static.FileCache(max_size=20, max_file_size=10)
+        assert cache.get(paths[0]) == b'a' * 10
+        assert cache.get(paths[1]) == b'b' * 10
+        cache.get(paths[0])
+        # b is the least recently used
+        cache.get(paths[2])
+        assert list(cache.files) == [paths[0], paths[2]]
+        assert cache.size == 20
+    finally:
+        shutil.rmtree(root)
+
+
+def test_mmap_content():
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'big')
+        content = os.urandom(rw.static.CHUNK_SIZE * 2 + 10)
+        with open(path, 'wb') as fileobj:
+            fileobj.write(content)
+        assert b''.join(rw.static.mmap_content(path)) == content
+        assert b''.join(rw.static.mmap_content(path, 5, 100000)) == content[5:100000]
+    finally:
+        shutil.rmtree(root)
+
+
+class ProductionStaticTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root,
+                                       extra_configs=[BASE + '/configs/production.yml'])
+
+    def test_cache_control(self):
+        static = self._app.scope['static']
+        url = static('/test.example/hello_world.txt')
+        response = self.fetch(url)
+        assert response.body == b'Hello Static World'
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+        response = self.fetch('/static/outdated/test.example/hello_world.txt')
+        assert response.body == b'Hello Static World'
+        assert response.headers['Cache-Control'] == 'no-cache'
+
+    def test_not_found(self):
+        assert self.fetch('/static/hash/test.example/nothing.txt').code == 404
+        assert self.fetch('/static/hash/test.example/../../__init__.py').code == 404
+
+    def test_large_file(self):
+        # larger than cache_file_size, served from a memory map
+        response = self.fetch('/static/hash/test.example/train')
+        assert response.code == 200
+        with open(os.path.join(BASE, 'example/static/test.example/train'), 'rb') as fileobj:
+            assert response.body == fileobj.read()
+        response = self.fetch('/static/hash/test.example/train',
+                              headers={'Range': 'bytes=10-19'})
+        assert response.code == 206
+        assert len(response.body) == 10
+
+    def test_no_stat(self):
+        # outside of development mode everything is known from the manifest
+        static = self._app.scope['static']
+        url = static('/test.example/hello_world.txt')
+        self.fetch(url)
+
+        def fail(*args, **kwargs):
+            raise AssertionError('file system accessed')
+        stat = os.stat
+        os.stat = fail
+        try:
+            response = self.fetch(url)
+            big = self.fetch('/static/hash/test.example/train')
+        finally:
+            os.stat = stat
+        assert response.body == b'Hello Static World'
+        assert 'Last-Modified' in response.headers
+        assert big.code == 200
+
+
+class DebugStaticTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root)
+
+    def test_lazy_manifest(self):
+        static = self._app.scope['static']
+        # nothing hashed at startup
+        assert static.manifest == {}
+        url = static('/test.example/hello_world.txt')
+        assert list(static.manifest) == ['/static/test.example/hello_world.txt']
+        assert self.fetch(url).body == b'Hello Static World'
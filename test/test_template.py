@@ -0,0 +1,94 @@
+import os
+import sys
+import imp
+import shutil
+import tempfile
+
+import jinja2
+import pytest
+
+import rw.template
+import rw.testing
+
+from . import example
+
+
+BASE = os.path.dirname(__file__)
+
+
+def test_bytecode_cache():
+    directory = os.path.join(tempfile.mkdtemp(), 'cache')
+    try:
+        bytecode_cache = rw.template.create_bytecode_cache(directory)
+        template_env = rw.template.create_template_env(['test.example'], bytecode_cache)
+        names = rw.template.compile_templates(template_env)
+        assert 'test.example/index.html' in names
+        assert len(os.listdir(directory)) == len(names)
+    finally:
+        shutil.rmtree(os.path.dirname(directory))
+
+
+def test_preload_skips_broken_files():
+    directory = tempfile.mkdtemp()
+    try:
+        files = {'index.html': b'Hello {{ name }}',
+                 'broken.html': b'{% if %}',
+                 'image.png': b'\x89PNG\xff\xfe'}
+        for name, content in files.items():
+            with open(os.path.join(directory, name), 'wb') as fileobj:
+                fileobj.write(content)
+        template_env = jinja2.Environment(loader=jinja2.FileSystemLoader(directory))
+        assert rw.template.preload(template_env) == ['index.html']
+        assert template_env.get_template('index.html').render(name='joe') == 'Hello joe'
+        with pytest.raises(jinja2.TemplateSyntaxError):
+            template_env.get_template('broken.html')
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_no_bytecode_cache():
+    assert rw.template.create_bytecode_cache(None) is None
+
+
+class ProductionTemplateTest(rw.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return rw.httpbase.Application(root=imp.reload(example).root,
+                                       extra_configs=[BASE + '/configs/production.yml'])
+
+    def test_preloaded(self):
+        template_env = self._app.scope['template_env']
+        assert not template_env.auto_reload
+        assert len(template_env.cache) == len(template_env.list_templates())
+        assert self.fetch('/foo').code == 200
+
+
+if sys.version_info >= (3, 6):
+    from .template_py3 import (AsyncTemplateTest, AsyncTemplateTimingTest,
+                               AsyncFragmentCacheTest, ResolveAwaitablesTest)
+
+
+def test_fragment_cache():
+    template_env = rw.template.create_template_env(['test.example'])
+    template = template_env.from_string(
+        '{% cache "counter" %}{{ counter() }}{% endcache %}'
+        '{% cache "ttl", 0 %}{{ counter() }}{% endcache %}')
+    calls = []
+
+    def counter():
+        calls.append(1)
+        return len(calls)
+
+    assert template.render(counter=counter) == '12'
+    # the first fragment is cached, the second expires immediately
+    assert template.render(counter=counter) == '13'
+
+
+def test_fragment_cache_lru():
+    cache = rw.template.FragmentCache(max_entries=2)
+    cache.set('a', 'A')
+    cache.set('b', 'B')
+    assert cache.get('a') == 'A'
+    cache.set('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'